@@ -0,0 +1,114 @@
+"""
+Benchmark of format_json_obj against the per-die loop it replaced
+
+Builds a layout for 1, 5 and 20 mm dies on a 300 mm wafer, checks that the vectorized
+serializer returns byte-identical JSON and reports the time of both.
+Run from the repository root:
+    python -m benchmarks.bench_format
+"""
+
+import argparse
+import json
+import time
+
+import numpy as np
+
+from opt.dies_per_wafer_calculator import DiesPerWaferCalculator
+
+SIZES = [1.0, 5.0, 20.0]  # die sizes on a 300 mm wafer
+
+
+def make_layout(size, ft, rng):
+    dpw = DiesPerWaferCalculator(
+        width=size,
+        height=size,
+        xspacing=0.1,
+        yspacing=0.1,
+        waferdiameter=300.0,
+        edgeexclusionwidth=3.0,
+        ft_grid=True,
+        searchdepth=0,
+        symmetric=False,
+        ft_ShiftRows=True,
+        ft_ShiftCols=False,
+        ft_ShiftRot=False,
+    )
+    if ft == 0:
+        offsets = rng.uniform(0, 1, 2) * (size + 0.1) / 2
+    else:
+        offsets = rng.uniform(0, 1, 2 * dpw.Ny + 2)
+        offsets[0] *= (size + 0.1) / 2
+    dpw.setlayout(offsets, ft, 300.0)
+    dpw.fitseed = None
+    return dpw
+
+
+def format_json_loop(dpw):
+    # format_json_obj as it was before vectorization, kept as the reference
+    json_data = dpw.json_header()  # the keys around the die lists are shared
+    del json_data["num_dies"], json_data["optimality_gap"]
+
+    partial_dies = []
+    valid_dies = []
+    for idx, _ in np.ndenumerate(dpw.Xcorner):
+        corner_pts = [
+            [dpw.Xcorner[idx], dpw.Ycorner[idx]],
+            [dpw.Xcorner[idx] + dpw.Xextent[idx], dpw.Ycorner[idx]],
+            [
+                dpw.Xcorner[idx] + dpw.Xextent[idx],
+                dpw.Ycorner[idx] + dpw.Yextent[idx],
+            ],
+            [dpw.Xcorner[idx], dpw.Ycorner[idx] + dpw.Yextent[idx]],
+        ]
+        if dpw.partial[idx]:
+            partial_dies.append(corner_pts)
+        if dpw.valid[idx]:
+            valid_dies.append(corner_pts)
+    json_data["num_dies"] = len(valid_dies)
+    json_data["optimality_gap"] = json_data["upper_bound"] - len(valid_dies)
+    json_data["valid_dies"] = valid_dies
+    json_data["partial_dies"] = partial_dies
+    return json.dumps(json_data)
+
+
+def timed(function, repeats):
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        result = function()
+        times.append(time.perf_counter() - start)
+    return result, min(times)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    rng = np.random.default_rng(args.seed)
+
+    print(
+        "{:>6} {:>3} {:>7} {:>10} {:>10} {:>8} {:>9}".format(
+            "die", "ft", "dies", "loop ms", "vector ms", "speedup", "identical"
+        )
+    )
+    for size in SIZES:
+        for ft in (0, 1):
+            dpw = make_layout(size, ft, rng)
+            reference, loop = timed(lambda: format_json_loop(dpw), args.repeats)
+            output, vector = timed(dpw.format_json_obj, args.repeats)
+            print(
+                "{:>6.1f} {:>3} {:>7} {:>10.2f} {:>10.2f} {:>7.1f}x {:>9}".format(
+                    size,
+                    ft,
+                    int(dpw.valid.sum()),
+                    loop * 1e3,
+                    vector * 1e3,
+                    loop / vector,
+                    str(output == reference),
+                )
+            )
+
+
+if __name__ == "__main__":
+    main()
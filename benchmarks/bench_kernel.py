@@ -0,0 +1,101 @@
+"""
+Micro-benchmark of a single objective evaluation with each objective kernel
+
+Reports the mean time and the peak transient memory allocated per countfulldies call.
+Run from the repository root:
+    python -m benchmarks.bench_kernel
+"""
+
+import argparse
+import time
+import tracemalloc
+
+import numpy as np
+
+from opt.dies_per_wafer_calculator import DiesPerWaferCalculator
+
+CASES = [  # (die size, wafer diameter, fit type)
+    (20.0, 200.0, 0),
+    (5.0, 300.0, 0),
+    (5.0, 300.0, 1),
+    (1.0, 300.0, 0),
+    (10.0, 200.0, 3),
+]
+
+
+def make_calculator(size, waferdiameter, kernel):
+    return DiesPerWaferCalculator(
+        width=size,
+        height=size,
+        xspacing=0.1,
+        yspacing=0.1,
+        waferdiameter=waferdiameter,
+        edgeexclusionwidth=3.0,
+        ft_grid=True,
+        searchdepth=0,
+        symmetric=False,
+        ft_ShiftRows=True,
+        ft_ShiftCols=True,
+        ft_ShiftRot=True,
+        kernel=kernel,
+    )
+
+
+def random_offsets(dpw, ft, n, rng):
+    nparams = {0: 2, 1: 2 * dpw.Ny + 2, 2: 2 * dpw.Nx + 2, 3: 4 * dpw.Nmax + 3}[ft]
+    offsets = rng.uniform(0, 1, (n, nparams))
+    offsets[:, 0] *= (dpw.width + dpw.xspacing) / 2
+    return offsets
+
+
+def measure(dpw, ft, offsets):
+    dpw.countfulldies(offsets[0], ft)  # warm up (allocates the buffers once)
+    tracemalloc.start()
+    peaks = []
+    for x in offsets:
+        tracemalloc.reset_peak()
+        before = tracemalloc.get_traced_memory()[0]
+        dpw.countfulldies(x, ft)
+        peaks.append(tracemalloc.get_traced_memory()[1] - before)
+    tracemalloc.stop()
+    start = time.perf_counter()
+    for x in offsets:
+        dpw.countfulldies(x, ft)
+    return (time.perf_counter() - start) / len(offsets), np.mean(peaks)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--evals", type=int, default=200)
+    args = parser.parse_args()
+    rng = np.random.default_rng(0)
+
+    print(
+        "{:>6} {:>6} {:>3} {:>10} {:>12} {:>14} {:>8}".format(
+            "die", "wafer", "ft", "kernel", "us/eval", "bytes/eval", "speedup"
+        )
+    )
+    for size, waferdiameter, ft in CASES:
+        offsets = None
+        reference_time = None
+        for kernel in ("reference", "buffered", "farthest", "rows"):
+            dpw = make_calculator(size, waferdiameter, kernel)
+            if offsets is None:
+                offsets = random_offsets(dpw, ft, args.evals, rng)
+            seconds, peak = measure(dpw, ft, offsets)
+            reference_time = reference_time or seconds
+            print(
+                "{:>6} {:>6} {:>3} {:>10} {:>12.1f} {:>14.0f} {:>7.2f}x".format(
+                    size,
+                    waferdiameter,
+                    ft,
+                    kernel,
+                    seconds * 1e6,
+                    peak,
+                    reference_time / seconds,
+                )
+            )
+
+
+if __name__ == "__main__":
+    main()
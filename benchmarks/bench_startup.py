@@ -0,0 +1,97 @@
+"""
+Cold-start benchmark of the Cloud Functions entry point
+
+Starts fresh interpreters and reports the time to import main, the time to the first
+response of fit_solution, and the warm-up steps recorded in main.startup_timings.
+Run from the repository root:
+    python -m benchmarks.bench_startup
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+CHILD = """
+import json, time
+start = time.perf_counter()
+import main
+imported = time.perf_counter()
+main.warm()
+warmed = time.perf_counter()
+main.fit_solution({request})
+responded = time.perf_counter()
+print("STARTUP " + json.dumps({{
+    "import": imported - start,
+    "warm": warmed - imported,
+    "first_response": responded - start,
+    "steps": main.startup_timings,
+}}))
+"""
+
+REQUEST = {
+    "width": 20.0,
+    "height": 20.0,
+    "xspacing": 1.0,
+    "yspacing": 1.0,
+    "edge_exclusion_width": 1.0,
+    "input_wafer_diameter": 200.0,
+    "ft_ShiftRows": True,
+    "ft_ShiftCols": True,
+    "ft_ShiftRot": False,
+    "symmetric": False,
+    "ft_grid": True,
+    "solver": "exact",
+}
+
+
+def run_child(warm_on_import):
+    env = dict(os.environ)
+    env["DPW_WARM_ON_IMPORT"] = "1" if warm_on_import else "0"
+    env["DPW_CACHE_DIR"] = ""  # a cache hit would hide the first fit
+    start = time.perf_counter()
+    output = subprocess.run(
+        [sys.executable, "-c", CHILD.format(request=repr(REQUEST))],
+        env=env,
+        capture_output=True,
+        text=True,
+        check=True,
+    ).stdout
+    total = time.perf_counter() - start
+    line = next(l for l in output.splitlines() if l.startswith("STARTUP "))
+    result = json.loads(line[len("STARTUP ") :])
+    result["process"] = total
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--repeats", type=int, default=5)
+    args = parser.parse_args()
+
+    for warm_on_import in (False, True):
+        runs = [run_child(warm_on_import) for _ in range(args.repeats)]
+        print(
+            "warm on import: {} (median of {} runs)".format(
+                warm_on_import, args.repeats
+            )
+        )
+        for key in ("import", "warm", "first_response", "process"):
+            print(
+                "  {:<16} {:8.1f} ms".format(
+                    key, 1e3 * statistics.median(run[key] for run in runs)
+                )
+            )
+        for step in runs[0]["steps"]:
+            print(
+                "  step {:<11} {:8.1f} ms".format(
+                    step, 1e3 * statistics.median(run["steps"][step] for run in runs)
+                )
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+"""
+Benchmark of warm-started annealing against random starts
+
+For each case, runs the Shift Rows and Shift Columns annealing from a random start,
+from the Uniform Grid result, and from the solution of a neighboring geometry (the
+same die with 0.1 mm more spacing) served by NeighborIndex. Reports the die count and
+the objective evaluations until that count was first reached, averaged over seeds.
+Run from the repository root:
+    python -m benchmarks.bench_warm_start
+"""
+
+import argparse
+
+import numpy as np
+
+from opt.dies_per_wafer_calculator import DiesPerWaferCalculator
+from opt.warm_start import NeighborIndex
+
+CASES = [  # (width, height, wafer diameter)
+    (10.0, 10.0, 200.0),
+    (7.0, 12.0, 300.0),
+]
+
+
+def make_calculator(width, height, waferdiameter, spacing):
+    return DiesPerWaferCalculator(
+        width=width,
+        height=height,
+        xspacing=spacing,
+        yspacing=spacing,
+        waferdiameter=waferdiameter,
+        edgeexclusionwidth=3.0,
+        ft_grid=True,
+        searchdepth=0,
+        symmetric=False,
+        ft_ShiftRows=True,
+        ft_ShiftCols=True,
+        ft_ShiftRot=False,
+        kernel="rows",
+    )
+
+
+def counted(dpw):
+    # wrap the objective to record the evaluation at which each best value appeared
+    trace = {"nfev": 0, "best": np.inf, "at": 0}
+    objective = dpw.countfulldies
+
+    def countfulldies(offsets, ft):
+        f = objective(offsets, ft)
+        trace["nfev"] += 1
+        if f < trace["best"]:
+            trace["best"], trace["at"] = f, trace["nfev"]
+        return f
+
+    dpw.countfulldies = countfulldies
+    return trace
+
+
+def run(dpw, ft, seed, x0):
+    trace = counted(dpw)
+    fit, _ = dpw.fitphase(ft, dpw.maxiter_grid0, dpw.maxiter_shift0, seed, x0=x0)
+    del dpw.countfulldies
+    return int(np.floor(-fit.fun)), trace["at"]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--seeds", type=int, default=3)
+    args = parser.parse_args()
+
+    print(
+        "{:>16} {:>3} {:>14} {:>14} {:>14}".format(
+            "case", "ft", "random", "grid", "neighbor"
+        )
+    )
+    for width, height, waferdiameter in CASES:
+        neighbor = make_calculator(width, height, waferdiameter, 0.2)
+        neighbor.fit()
+        index = NeighborIndex()
+        index.add(neighbor)
+        dpw = make_calculator(width, height, waferdiameter, 0.1)
+        x0 = index.lookup(dpw)
+        grid, _ = dpw.fitphase(0, dpw.maxiter_grid0, dpw.maxiter_shift0, 0)
+        for ft in (1, 2):
+            starts = (None, dpw.warmstart(ft, grid=grid.x), dpw.warmstart(ft, x0))
+            results = [
+                [run(dpw, ft, seed, start) for seed in range(args.seeds)]
+                for start in starts
+            ]
+            print(
+                "{:>16} {:>3} {}".format(
+                    "{:g}x{:g}/{:g}".format(width, height, waferdiameter),
+                    ft,
+                    " ".join(
+                        "{:>5.0f} @{:>7.0f}".format(
+                            np.mean([count for count, _ in r]),
+                            np.mean([at for _, at in r]),
+                        )
+                        for r in results
+                    ),
+                )
+            )
+
+
+if __name__ == "__main__":
+    main()
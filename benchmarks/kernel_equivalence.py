@@ -0,0 +1,101 @@
+"""
+Randomized equivalence check of every objective kernel against the reference kernel
+
+Draws random die/wafer geometries and random offset vectors for every fit type, with and
+without the symmetric constraint, and checks that countfulldies and countfulldiesbatch
+return exactly the reference die count for each kernel. Exits non-zero on any mismatch.
+Run from the repository root:
+    python -m benchmarks.kernel_equivalence
+"""
+
+import argparse
+import sys
+
+import numpy as np
+
+from opt.dies_per_wafer_calculator import DiesPerWaferCalculator
+
+KERNELS = ("buffered", "farthest", "rows")
+
+
+def make_calculator(geometry, symmetric, kernel):
+    width, height, xspacing, yspacing, waferdiameter, edgeexclusionwidth = geometry
+    return DiesPerWaferCalculator(
+        width=width,
+        height=height,
+        xspacing=xspacing,
+        yspacing=yspacing,
+        waferdiameter=waferdiameter,
+        edgeexclusionwidth=edgeexclusionwidth,
+        ft_grid=True,
+        searchdepth=0,
+        symmetric=symmetric,
+        ft_ShiftRows=True,
+        ft_ShiftCols=True,
+        ft_ShiftRot=True,
+        kernel=kernel,
+    )
+
+
+def random_offsets(dpw, ft, n, rng):
+    if dpw.symmetric:
+        nparams = {0: 2, 1: dpw.Ny + 2, 2: dpw.Nx + 2, 3: 2 * dpw.Nmax + 3}[ft]
+        return rng.uniform(0, 1, (n, nparams))
+    nparams = {0: 2, 1: 2 * dpw.Ny + 2, 2: 2 * dpw.Nx + 2, 3: 4 * dpw.Nmax + 3}[ft]
+    offsets = rng.uniform(0, 1, (n, nparams))
+    if ft == 0:
+        offsets[:, 0] *= (dpw.width + dpw.xspacing) / 2
+        offsets[:, 1] *= (dpw.height + dpw.yspacing) / 2
+    elif ft == 1:
+        offsets[:, 0] *= (dpw.height + dpw.yspacing) / 2
+    elif ft == 2:
+        offsets[:, 0] *= (dpw.width + dpw.xspacing) / 2
+    else:
+        offsets[:, 0] *= (max(dpw.width, dpw.height) + dpw.yspacing) / 2
+    return offsets
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--geometries", type=int, default=50)
+    parser.add_argument("--offsets", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    rng = np.random.default_rng(args.seed)
+
+    checked = 0
+    mismatches = 0
+    for _ in range(args.geometries):
+        geometry = (
+            rng.uniform(0.5, 30),
+            rng.uniform(0.5, 30),
+            rng.uniform(0, 2),
+            rng.uniform(0, 2),
+            rng.choice([100.0, 150.0, 200.0, 300.0]),
+            rng.uniform(0, 5),
+        )
+        for symmetric in (False, True):
+            reference = make_calculator(geometry, symmetric, "reference")
+            for ft in range(4):
+                offsets = random_offsets(reference, ft, args.offsets, rng)
+                expected = np.array([reference.countfulldies(x, ft) for x in offsets])
+                for kernel in KERNELS:
+                    dpw = make_calculator(geometry, symmetric, kernel)
+                    scalar = np.array([dpw.countfulldies(x, ft) for x in offsets])
+                    batch = dpw.countfulldiesbatch(offsets, ft)
+                    bad = (scalar != expected) | (batch != expected)
+                    checked += len(offsets)
+                    mismatches += bad.sum()
+                    for x in offsets[bad]:
+                        print(
+                            "mismatch: kernel={} ft={} symmetric={} geometry={} "
+                            "offsets={}".format(
+                                kernel, ft, symmetric, geometry, list(x)
+                            )
+                        )
+    print("{} evaluations checked, {} mismatches".format(checked, mismatches))
+    return 1 if mismatches else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
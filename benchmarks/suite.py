@@ -0,0 +1,216 @@
+"""
+Benchmark suite of fit quality and latency
+
+Fits a fixed catalogue of die/wafer cases, from tiny to huge dies on 100 to 300 mm
+wafers, once per fit type, search depth, symmetric setting and solver. Every row
+records the wall time, objective evaluations, peak traced memory and die count, and
+the count is checked against the known-best reference in reference.json (from the
+exact solvers). Results go to a JSON file; --compare checks them against the file
+of an earlier commit. The exit status is 1 when the exact solvers miss a reference
+count or any row lost dies against the baseline, so a speedup can't silently cost
+dies. Run from the repository root:
+    python -m benchmarks.suite --out results.json
+    python -m benchmarks.suite --out new.json --compare results.json
+    python -m benchmarks.suite --update-reference
+"""
+
+import argparse
+import itertools
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+import scipy
+
+from opt.dies_per_wafer_calculator import DiesPerWaferCalculator
+
+CASES = {  # name: (width, height, spacing, wafer diameter, edge exclusion)
+    "tiny": (0.8, 0.6, 0.05, 100.0, 2.0),
+    "small": (3.0, 4.0, 0.1, 150.0, 3.0),
+    "medium": (10.0, 10.0, 0.1, 200.0, 3.0),
+    "large": (25.0, 32.0, 0.2, 300.0, 3.0),
+    "huge": (60.0, 80.0, 0.2, 300.0, 3.0),
+}
+FITTYPES = (0, 1, 2, 3)
+REFERENCE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "reference.json")
+SEED = 0  # annealing runs are seeded, so counts only change when the code does
+
+
+def make_calculator(case, ft, searchdepth, symmetric, solver):
+    width, height, spacing, waferdiameter, edge = CASES[case]
+    return DiesPerWaferCalculator(
+        width=width,
+        height=height,
+        xspacing=spacing,
+        yspacing=spacing,
+        waferdiameter=waferdiameter,
+        edgeexclusionwidth=edge,
+        ft_grid=ft == 0,
+        searchdepth=searchdepth,
+        symmetric=symmetric,
+        ft_ShiftRows=ft == 1,
+        ft_ShiftCols=ft == 2,
+        ft_ShiftRot=ft == 3,
+        solver=solver,
+        seed=None if solver == "exact" else SEED,
+    )
+
+
+def row_key(row):
+    return "{case}/ft{ft}/sym{symmetric:d}/depth{searchdepth}/{solver}".format(**row)
+
+
+def reference_key(case, ft, symmetric):
+    return "{}/ft{}/sym{:d}".format(case, ft, symmetric)
+
+
+def run_case(case, ft, searchdepth, symmetric, solver, memory):
+    dpw = make_calculator(case, ft, searchdepth, symmetric, solver)
+    start = time.perf_counter()
+    dpw.fit()
+    seconds = time.perf_counter() - start
+    peak = None
+    if memory:
+        # a second, traced run: tracing slows the allocations down
+        traced = make_calculator(case, ft, searchdepth, symmetric, solver)
+        tracemalloc.start()
+        traced.fit()
+        peak = tracemalloc.get_traced_memory()[1] / 2**20
+        tracemalloc.stop()
+    return {
+        "case": case,
+        "ft": ft,
+        "searchdepth": searchdepth,
+        "symmetric": symmetric,
+        "solver": solver,
+        "seconds": seconds,
+        "nfev": int(dpw.fitnfev[ft]),
+        "peak_mb": peak,
+        "count": int(dpw.Nfit),
+    }
+
+
+def commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def update_reference(cases):
+    # known-best counts: the exact solvers are optimal within each fit type
+    reference = {}
+    if os.path.exists(REFERENCE):
+        with open(REFERENCE) as f:
+            reference = json.load(f)
+    for case, ft, symmetric in itertools.product(cases, FITTYPES, (False, True)):
+        row = run_case(case, ft, 0, symmetric, "exact", memory=False)
+        reference[reference_key(case, ft, symmetric)] = row["count"]
+        print("{} {}".format(reference_key(case, ft, symmetric), row["count"]))
+    with open(REFERENCE, "w") as f:
+        json.dump(reference, f, indent=1, sort_keys=True)
+        f.write("\n")
+
+
+def check(rows, reference, baseline):
+    # lines describing every lost die, empty when nothing regressed
+    problems = []
+    previous = {row_key(row): row for row in baseline or []}
+    for row in rows:
+        known = reference.get(reference_key(row["case"], row["ft"], row["symmetric"]))
+        if row["solver"] == "exact" and known is not None and row["count"] < known:
+            problems.append(
+                "{}: {} dies, reference {}".format(row_key(row), row["count"], known)
+            )
+        before = previous.get(row_key(row))
+        if before is not None and row["count"] < before["count"]:
+            problems.append(
+                "{}: {} dies, baseline {}".format(
+                    row_key(row), row["count"], before["count"]
+                )
+            )
+    return problems
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--cases", nargs="+", default=list(CASES), choices=CASES)
+    parser.add_argument("--depths", type=int, nargs="+", default=[0])
+    parser.add_argument("--solvers", nargs="+", default=["exact", "anneal"])
+    parser.add_argument("--no-memory", action="store_true", help="skip traced runs")
+    parser.add_argument("--out", default=None, help="JSON results file")
+    parser.add_argument("--compare", default=None, help="JSON results of a baseline")
+    parser.add_argument("--update-reference", action="store_true")
+    args = parser.parse_args()
+    if args.update_reference:
+        update_reference(args.cases)
+        return
+
+    with open(REFERENCE) as f:
+        reference = json.load(f)
+    baseline = None
+    if args.compare is not None:
+        with open(args.compare) as f:
+            baseline = {row_key(row): row for row in json.load(f)["results"]}
+
+    print(
+        "{:<36} {:>9} {:>9} {:>9} {:>7} {:>7} {:>8}".format(
+            "case", "seconds", "nfev", "peak MB", "count", "ref", "vs base"
+        )
+    )
+    rows = []
+    for case, ft, depth, symmetric, solver in itertools.product(
+        args.cases, FITTYPES, args.depths, (False, True), args.solvers
+    ):
+        if solver == "exact" and depth != args.depths[0]:
+            continue  # the exact solvers ignore the search depth
+        row = run_case(case, ft, depth, symmetric, solver, not args.no_memory)
+        row["reference"] = reference.get(reference_key(case, ft, symmetric))
+        rows.append(row)
+        before = (baseline or {}).get(row_key(row))
+        print(
+            "{:<36} {:>9.3f} {:>9} {:>9} {:>7} {:>7} {:>8}".format(
+                row_key(row),
+                row["seconds"],
+                row["nfev"],
+                "-" if row["peak_mb"] is None else "{:.2f}".format(row["peak_mb"]),
+                row["count"],
+                "-" if row["reference"] is None else row["reference"],
+                (
+                    "-"
+                    if before is None
+                    else "{:.2f}x".format(row["seconds"] / before["seconds"])
+                ),
+            )
+        )
+
+    if args.out is not None:
+        with open(args.out, "w") as f:
+            json.dump(
+                {
+                    "commit": commit(),
+                    "python": platform.python_version(),
+                    "numpy": np.__version__,
+                    "scipy": scipy.__version__,
+                    "cpu_count": os.cpu_count(),
+                    "results": rows,
+                },
+                f,
+                indent=1,
+            )
+    problems = check(rows, reference, (baseline or {}).values())
+    for problem in problems:
+        print("LOST DIES " + problem)
+    if problems:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,13 +1,104 @@
 import functions_framework
-import google.cloud.logging
+import importlib
 import logging
-from opt.dies_per_wafer_calculator import DiesPerWaferCalculator
+import json
+import os
+import threading
+import time
+from flask import Response
+from opt.fit_memo import FitMemo
+from opt.result_cache import CACHE_DIR, ResultCache, cache_key, with_cache_metadata
 
-logging_client = google.cloud.logging.Client()
-logging_client.setup_logging()
+# numpy/scipy (through the SOLVER_MODULES) and google.cloud.logging are imported by
+# warm(), not at import time, to keep cold starts short
+SOLVER_MODULES = (
+    "opt.dies_per_wafer_calculator",
+    "opt.wafer_map",
+    "opt.atlas",
+    "opt.warm_start",
+)
 
+logging_client = None  # built on warm-up
+result_cache = None  # opened on warm-up
+fit_memo = FitMemo()  # equivalent problems seen by this instance
+atlas = None  # opened on warm-up
+neighbor_index = None  # warm starts from recent fits, built on first use
+warm_lock = threading.Lock()
+startup_timings = {}  # seconds spent in each warm-up step, filled once per process
+SOLVERS = ("anneal", "exact")
+MAX_STARTS = 64  # annealing starts per fit type a single request may ask for
 
-def fit_solution(request_json):
+
+def setup_cloud_logging():
+    global logging_client
+    if logging_client is None:
+        import google.cloud.logging
+
+        logging_client = google.cloud.logging.Client()
+        logging_client.setup_logging()
+    return logging_client
+
+
+def import_solver():
+    for name in SOLVER_MODULES:
+        importlib.import_module(name)
+
+
+def warm():
+    # per-process setup deferred from import time. Idempotent and thread-safe: a request
+    # arriving while the warm-up thread is still running waits for it to finish
+    with warm_lock:
+        if not startup_timings:
+            for name, step in (
+                ("logging_client", setup_cloud_logging),
+                ("imports", import_solver),
+                ("atlas", get_atlas),
+                ("result_cache", get_result_cache),
+            ):
+                start = time.perf_counter()
+                try:
+                    step()
+                except Exception as e:
+                    logging.warning(f"Warm-up step {name} failed: {e}")
+                startup_timings[name] = time.perf_counter() - start
+            logging.info(f"Warm-up timings: {startup_timings}")
+    return startup_timings
+
+
+def get_atlas():
+    global atlas
+    from opt.atlas import ATLAS_DIR, Atlas
+
+    if atlas is None and os.path.isdir(ATLAS_DIR):
+        try:
+            atlas = Atlas(ATLAS_DIR)
+        except Exception as e:
+            logging.warning(f"Atlas unavailable: {e}")
+    return atlas
+
+
+def get_neighbor_index():
+    global neighbor_index
+    if neighbor_index is None:
+        from opt.warm_start import NeighborIndex
+
+        neighbor_index = NeighborIndex()
+    return neighbor_index
+
+
+def get_result_cache():
+    global result_cache
+    if result_cache is None and CACHE_DIR:
+        try:
+            result_cache = ResultCache()
+        except Exception as e:
+            logging.warning(f"Result cache unavailable: {e}")
+    return result_cache
+
+
+def request_inputs(request_json, encoding=None):
+    # every input of a request that can change its response, defaults filled in. The
+    # cache key and the job id of a request are the cache_key of these
     try:
         width = request_json["width"]
         height = request_json["height"]
@@ -23,24 +114,122 @@ def fit_solution(request_json):
     except Exception as e:
         logging.error(f"Missing entry in request: {e}")
         raise e
+    from opt.wafer_map import ENCODINGS
+
+    # a request field wins over the encoding negotiated from the Accept header
+    encoding = request_json.get("encoding", encoding or "corners")
+    if encoding not in ENCODINGS:
+        logging.error(f"Unknown encoding in request: {encoding}")
+        raise ValueError(f"Unknown encoding {encoding!r}, expected one of {ENCODINGS}")
+    searchdepth = request_json.get("searchdepth", 0)
+    if searchdepth not in (0, 1, 2):
+        logging.error(f"Unknown searchdepth in request: {searchdepth}")
+        raise ValueError(f"Unknown searchdepth {searchdepth!r}, expected 0, 1 or 2")
+    solver = request_json.get("solver", "anneal")
+    if solver not in SOLVERS:
+        logging.error(f"Unknown solver in request: {solver}")
+        raise ValueError(f"Unknown solver {solver!r}, expected one of {SOLVERS}")
+    starts = request_json.get("starts", 1)
+    if type(starts) is not int or not 1 <= starts <= MAX_STARTS:
+        logging.error(f"Invalid starts in request: {starts}")
+        raise ValueError(
+            f"Invalid starts {starts!r}, expected an integer from 1 to {MAX_STARTS}"
+        )
+    seed = request_json.get("seed", None)
+    if seed is not None and (type(seed) is not int or seed < 0):
+        logging.error(f"Invalid seed in request: {seed}")
+        raise ValueError(f"Invalid seed {seed!r}, expected a non-negative integer")
+    time_budget = request_json.get("time_budget", None)
+    if time_budget is not None and (
+        type(time_budget) not in (int, float) or not 0 < time_budget < float("inf")
+    ):
+        logging.error(f"Invalid time_budget in request: {time_budget}")
+        raise ValueError(
+            f"Invalid time_budget {time_budget!r}, expected a positive number of seconds"
+        )
+    return {
+        "width": width,
+        "height": height,
+        "xspacing": xspacing,
+        "yspacing": yspacing,
+        "input_wafer_diameter": waferdiameter,
+        "edge_exclusion_width": edgeexclusionwidth,
+        "ft_grid": bool(ft_grid),
+        "symmetric": bool(symmetric),
+        "ft_ShiftRows": bool(ft_ShiftRows),
+        "ft_ShiftCols": bool(ft_ShiftCols),
+        "ft_ShiftRot": bool(ft_ShiftRot),
+        "searchdepth": searchdepth,
+        "solver": solver,
+        "starts": starts,
+        "seed": seed,
+        "time_budget": time_budget,
+        "encoding": encoding,
+        "compress": bool(request_json.get("compress", False))
+        and encoding == "columnar",
+        "diagnostics": bool(request_json.get("diagnostics", False)),
+    }
+
+
+def fit_solution(request_json, encoding=None):
+    return fit_payload(request_json, encoding)[0]
+
+
+def fit_payload(request_json, encoding=None):
+    # (response, finished). A search cut short by its time budget depends on the load
+    # of the moment, so it is neither cached nor memoized
+    inputs = request_inputs(request_json, encoding)
+    from opt.dies_per_wafer_calculator import DiesPerWaferCalculator
+    from opt.wafer_map import format_response
+
+    cache = get_result_cache()
+    if cache is not None:
+        start = time.perf_counter()
+        key = cache_key(inputs)
+        payload = cache.get(key)
+        if payload is not None:
+            return (
+                with_cache_metadata(payload, True, key, time.perf_counter() - start),
+                True,
+            )
 
     dpw = DiesPerWaferCalculator(
-        width=width,
-        height=height,
-        xspacing=xspacing,
-        yspacing=yspacing,
-        waferdiameter=waferdiameter,
-        edgeexclusionwidth=edgeexclusionwidth,
-        ft_grid=ft_grid,
-        searchdepth=0,
-        symmetric=symmetric,
-        ft_ShiftRows=ft_ShiftRows,
-        ft_ShiftCols=ft_ShiftCols,
-        ft_ShiftRot=ft_ShiftRot,
+        width=inputs["width"],
+        height=inputs["height"],
+        xspacing=inputs["xspacing"],
+        yspacing=inputs["yspacing"],
+        waferdiameter=inputs["input_wafer_diameter"],
+        edgeexclusionwidth=inputs["edge_exclusion_width"],
+        ft_grid=inputs["ft_grid"],
+        searchdepth=inputs["searchdepth"],
+        symmetric=inputs["symmetric"],
+        ft_ShiftRows=inputs["ft_ShiftRows"],
+        ft_ShiftCols=inputs["ft_ShiftCols"],
+        ft_ShiftRot=inputs["ft_ShiftRot"],
+        solver=inputs["solver"],
+        # parallel only changes how the fit runs, not its result
+        parallel=request_json.get("parallel", False),
+        starts=inputs["starts"],
+        seed=inputs["seed"],
+        time_budget=inputs["time_budget"],
     )
-    dpw.fit()
-    json_str = dpw.format_json_obj()
-    return json_str
+    precomputed = get_atlas()
+    if precomputed is None or not precomputed.apply(dpw):
+        neighbors = get_neighbor_index()
+        # a seeded request asks for that specific search, so it never starts from
+        # another request's solution
+        x0 = neighbors.lookup(dpw) if inputs["seed"] is None else None
+        if not fit_memo.fit(dpw, x0):
+            neighbors.add(dpw)
+    json_str = format_response(
+        dpw, inputs["encoding"], inputs["compress"], inputs["diagnostics"]
+    )
+    logging.info("Fit diagnostics", extra={"json_fields": dpw.diagnostics})
+    if cache is not None:
+        if dpw.finished:
+            cache.put(key, json_str)
+        json_str = with_cache_metadata(json_str, False, key, 0.0)
+    return json_str, bool(dpw.finished)
 
 
 ### CLOUD FUNCTIONS ENTRYPOINT
@@ -49,12 +238,178 @@ def calculate_dies_per_wafer(request):
     """
     Entry point for Google Cloud Functions
         This function must be chosen as the entrypoint when defining the function in the Google Cloud Console
+        Every route is served by this one function, so the job queue and its workers
+        live in the same instance as the requests that poll them:
+            POST /jobs                submit_dies_per_wafer_job
+            GET  /jobs/<id>           dies_per_wafer_job_status
+            GET  /jobs/<id>/result    dies_per_wafer_job_result
+            POST /batch               calculate_dies_per_wafer_batch
+            anything else             a single fit
     """
+    parts = request.path.strip("/").split("/")
+    if parts == ["batch"] and request.method == "POST":
+        return calculate_dies_per_wafer_batch(request)
+    if parts[0] == "jobs":
+        if len(parts) == 1 and request.method == "POST":
+            return submit_dies_per_wafer_job(request)
+        if len(parts) == 2 and request.method == "GET":
+            return dies_per_wafer_job_status(parts[1])
+        if len(parts) == 3 and parts[2] == "result" and request.method == "GET":
+            return dies_per_wafer_job_result(parts[1])
+        return json_response({"error": "unknown job route"}, 404)
+
+    warm()
+    from opt.wafer_map import negotiate
+
     request_json = request.get_json()
-    result = fit_solution(request_json)
+    result = fit_solution(request_json, negotiate(request.headers.get("Accept")))
     return result
 
 
+batch_pool = None  # worker processes shared by every batch on this instance
+
+
+def get_batch_pool():
+    global batch_pool
+    if batch_pool is None:
+        from concurrent.futures import ProcessPoolExecutor
+
+        batch_pool = ProcessPoolExecutor(
+            max_workers=int(os.environ.get("DPW_BATCH_WORKERS", os.cpu_count()))
+        )
+    return batch_pool
+
+
+def fit_batch_item(index, request_json, encoding=None):
+    # one NDJSON line for one configuration, errors are reported instead of raised so a
+    # bad configuration does not fail the whole batch
+    try:
+        result = fit_solution(request_json, encoding)
+    except Exception as e:
+        return json.dumps({"index": index, "error": f"{type(e).__name__}: {e}"})
+    return '{"index": ' + str(index) + ', "result": ' + result + "}"
+
+
+def fit_batch(configurations, encoding=None):
+    # NDJSON lines in completion order, each tagged with its index in the batch
+    from concurrent.futures import as_completed
+
+    pool = get_batch_pool()
+    futures = [
+        pool.submit(fit_batch_item, index, request_json, encoding)
+        for index, request_json in enumerate(configurations)
+    ]
+    for future in as_completed(futures):
+        yield future.result() + "\n"
+
+
+def calculate_dies_per_wafer_batch(request):
+    """
+    Batch route of calculate_dies_per_wafer, POST /batch
+        Accepts {"configurations": [...]} (or a bare list) of calculate_dies_per_wafer
+        requests and streams one JSON line per configuration as it finishes
+    """
+    warm()  # before the pool forks, so workers inherit the imports and state
+    from opt.wafer_map import negotiate
+
+    request_json = request.get_json()
+    if isinstance(request_json, dict):
+        request_json = request_json.get("configurations")
+    if not isinstance(request_json, list):
+        logging.error("Batch request must be a list of configurations")
+        return Response(
+            json.dumps({"error": "expected a list of configurations"}),
+            status=400,
+            mimetype="application/json",
+        )
+    encoding = negotiate(request.headers.get("Accept"))
+    return Response(fit_batch(request_json, encoding), mimetype="application/x-ndjson")
+
+
+job_queue = None  # opened on the first job request
+job_workers = None  # threads of this instance running queued jobs
+job_lock = threading.Lock()
+
+
+def get_job_queue():
+    # the job queue, with this instance's workers started on first use
+    global job_queue, job_workers
+    with job_lock:
+        if job_queue is None:
+            from opt.job_queue import JobQueue, JobWorkers
+
+            job_queue = JobQueue()
+            job_workers = JobWorkers(
+                job_queue,
+                run_job,
+                concurrency=int(os.environ.get("DPW_JOB_WORKERS", 1)),
+            )
+            job_workers.start()
+    return job_queue
+
+
+def run_job(request_json):
+    # (response, finished) of a job. The fit runs in the batch worker processes, so a
+    # long search doesn't hold the GIL
+    return get_batch_pool().submit(fit_payload, request_json).result()
+
+
+def json_response(data, status=200):
+    return Response(json.dumps(data), status=status, mimetype="application/json")
+
+
+def submit_dies_per_wafer_job(request):
+    # POST /jobs: queues a calculate_dies_per_wafer request and answers at once with its
+    # job id. The id is the content address of the input, so a duplicate submission
+    # returns the existing job
+    warm()
+    from opt.wafer_map import negotiate
+
+    request_json = request.get_json()
+    try:
+        inputs = request_inputs(request_json, negotiate(request.headers.get("Accept")))
+    except Exception as e:
+        return json_response({"error": f"{type(e).__name__}: {e}"}, 400)
+    job_id = cache_key(inputs)
+    queue = get_job_queue()
+    # the negotiated encoding is kept with the job, the worker has no Accept header
+    status = queue.submit(job_id, dict(request_json, encoding=inputs["encoding"]))
+    job_workers.notify()
+    return json_response({"job_id": job_id, "status": status}, 202)
+
+
+def dies_per_wafer_job_status(job_id):
+    # GET /jobs/<id>: the status of the job, queued, running, done or failed
+    status = get_job_queue().status(job_id)
+    if status is None:
+        return json_response({"error": "unknown job"}, 404)
+    return json_response(status)
+
+
+def dies_per_wafer_job_result(job_id):
+    # GET /jobs/<id>/result: the calculate_dies_per_wafer response of a finished job,
+    # or its status with 202 while it is queued or running
+    from opt.job_queue import DONE, FAILED
+
+    queue = get_job_queue()
+    status = queue.status(job_id)
+    if status is None:
+        return json_response({"error": "unknown job"}, 404)
+    if status["status"] == DONE:
+        payload = queue.result(job_id)
+        if payload is None:
+            return json_response({"error": "unknown job"}, 404)  # evicted since
+        return Response(payload, mimetype="application/json")
+    if status["status"] == FAILED:
+        return json_response(status, 500)
+    return json_response(status, 202)
+
+
+if os.environ.get("DPW_WARM_ON_IMPORT", "1") == "1":
+    # overlap the warm-up with the rest of the server start, off the import path
+    threading.Thread(target=warm, daemon=True).start()
+
+
 if __name__ == "__main__":
     test_input = {
         "width": 20.0,
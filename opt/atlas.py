@@ -0,0 +1,277 @@
+"""
+Precomputed dies-per-wafer atlas for standard wafer sizes
+
+The atlas directory holds two memory-mappable NumPy files:
+    points.npy   structured array, one record per (wafer, edge exclusion, die size,
+                 spacing, symmetric) point with, for each fit type fitted, the best
+                 count, final diameter and the slice of its offsets
+    offsets.npy  flat float64 array with the final offsets of every point
+A request for any subset of the fitted types is answered from the same record,
+taking the first fit type with the highest count as a fit would. The index from
+input values to record is built from points.npy when the atlas is opened, and an
+atlas written with another ATLAS_VERSION is refused. Build it offline with
+    python -m opt.atlas --out atlas --workers 8
+"""
+
+import argparse
+import math
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from opt.dies_per_wafer_calculator import DiesPerWaferCalculator
+
+ATLAS_DIR = os.environ.get(
+    "DPW_ATLAS_DIR",
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "atlas"),
+)
+
+ATLAS_VERSION = 2  # bump when the layout or meaning of points.npy changes
+
+POINT_DTYPE = np.dtype(
+    [
+        ("version", "u2"),  # ATLAS_VERSION of the build
+        ("waferdiameter", "f8"),
+        ("edgeexclusionwidth", "f8"),
+        ("width", "f8"),
+        ("height", "f8"),
+        ("xspacing", "f8"),
+        ("yspacing", "f8"),
+        ("symmetric", "u1"),
+        ("fittypes", "u1"),  # bit ft set when fit type ft was fitted
+        # per fit type, indexed by ft
+        ("count", "i4", (4,)),
+        ("final_diameter", "f8", (4,)),
+        ("offsets_start", "i8", (4,)),
+        ("offsets_count", "i4", (4,)),
+    ]
+)
+
+
+def fittype_bits(ft_grid, ft_ShiftRows, ft_ShiftCols, ft_ShiftRot):
+    return sum(
+        1 << ft
+        for ft, on in enumerate((ft_grid, ft_ShiftRows, ft_ShiftCols, ft_ShiftRot))
+        if on
+    )
+
+
+def point_key(
+    waferdiameter, edgeexclusionwidth, width, height, xspacing, yspacing, sym
+):
+    # exact match on the input values, 20 and 20.0 are the same point
+    return (
+        float(waferdiameter),
+        float(edgeexclusionwidth),
+        float(width),
+        float(height),
+        float(xspacing),
+        float(yspacing),
+        bool(sym),
+    )
+
+
+class Atlas:
+    def __init__(self, directory=ATLAS_DIR) -> None:
+        self.points = np.load(os.path.join(directory, "points.npy"), mmap_mode="r")
+        self.offsets = np.load(os.path.join(directory, "offsets.npy"), mmap_mode="r")
+        if self.points.dtype != POINT_DTYPE or np.any(
+            self.points["version"] != ATLAS_VERSION
+        ):
+            raise ValueError(
+                "Atlas in {} is not version {}, rebuild it with python -m "
+                "opt.atlas".format(directory, ATLAS_VERSION)
+            )
+        self.index = {
+            point_key(*record): row
+            for row, record in enumerate(
+                zip(
+                    *(
+                        self.points[name].tolist()
+                        for name in POINT_DTYPE.names[1:8]  # the input fields
+                    )
+                )
+            )
+        }
+
+    def lookup(self, dpw):
+        # (fit type, count, final diameter, offsets) of the calculator's problem, or
+        # None when the point or one of its enabled fit types was not fitted
+        row = self.index.get(
+            point_key(
+                dpw.waferdiameter,
+                dpw.edgeexclusionwidth,
+                dpw.width,
+                dpw.height,
+                dpw.xspacing,
+                dpw.yspacing,
+                dpw.symmetric,
+            )
+        )
+        bits = fittype_bits(
+            dpw.ft_grid, dpw.ft_ShiftRows, dpw.ft_ShiftCols, dpw.ft_ShiftRot
+        )
+        if row is None or bits == 0:
+            return None
+        point = self.points[row]
+        if bits & ~int(point["fittypes"]):
+            return None
+        enabled = [ft for ft in range(4) if bits & (1 << ft)]
+        counts = point["count"][enabled]
+        fittype = enabled[int(np.argmax(counts))]  # ties go to the first fit type
+        start = int(point["offsets_start"][fittype])
+        count = int(point["offsets_count"][fittype])
+        offsets = np.array(self.offsets[start : start + count])
+        return (
+            fittype,
+            int(point["count"][fittype]),
+            float(point["final_diameter"][fittype]),
+            offsets,
+        )
+
+    def apply(self, dpw):
+        # rebuild the layout of an atlas point on dpw instead of fitting
+        # returns True on a hit. A seeded or multi-start request asks for that specific
+        # search, so it is never answered from the atlas
+        if dpw.starts != 1 or dpw.seed is not None:
+            return False
+        found = self.lookup(dpw)
+        if found is None:
+            return False
+        fittype, count, diameter, offsets = found
+        dpw.setlayout(offsets, fittype, diameter)
+        dpw.fitseeds = [None, None, None, None]
+        dpw.fitseed = None
+        dpw.Nfit = count
+        dpw.finished = True  # atlas points come from complete searches
+        dpw.start = dpw.end = time.time()
+        dpw.diagnostics["source"] = "atlas"
+        return True
+
+
+def fit_point(args):
+    # fit one fit type of one atlas point, run in a worker process
+    waferdiameter, edge, width, height, spacing, symmetric, ft, solver = args
+    dpw = DiesPerWaferCalculator(
+        width=width,
+        height=height,
+        xspacing=spacing,
+        yspacing=spacing,
+        waferdiameter=waferdiameter,
+        edgeexclusionwidth=edge,
+        ft_grid=ft == 0,
+        searchdepth=0,
+        symmetric=symmetric,
+        ft_ShiftRows=ft == 1,
+        ft_ShiftCols=ft == 2,
+        ft_ShiftRot=ft == 3,
+        solver=solver,
+    )
+    dpw.fit()
+    return (
+        int(dpw.Nfit),
+        float(dpw.final_diameter),
+        np.asarray(dpw.final_offsets, dtype=float),
+    )
+
+
+def build(
+    directory,
+    waferdiameters,
+    edgeexclusions,
+    spacings,
+    sizes,
+    fittypes=0b1111,
+    symmetric=(False,),
+    solver="exact",
+    workers=None,
+):
+    # fit every combination offline, each fit type on its own, and write points.npy
+    # and offsets.npy
+    grid = [
+        (float(wd), float(ee), float(w), float(h), float(s), sym)
+        for wd in waferdiameters
+        for ee in edgeexclusions
+        for s in spacings
+        for w in sizes
+        for h in sizes
+        for sym in symmetric
+        if math.hypot(w, h) / 2 <= wd / 2 - ee  # at least one die fits
+    ]
+    fitted = [ft for ft in range(4) if fittypes & (1 << ft)]
+    tasks = [point + (ft, solver) for point in grid for ft in fitted]
+    points = np.zeros(len(grid), dtype=POINT_DTYPE)
+    points["version"] = ATLAS_VERSION
+    points["fittypes"] = fittypes
+    points["count"] = -1  # fit types not fitted
+    if grid:
+        wd, ee, w, h, s, sym = zip(*grid)
+        for name, column in zip(POINT_DTYPE.names[1:8], (wd, ee, w, h, s, s, sym)):
+            points[name] = column
+    offsets = []
+    start = 0
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        results = pool.map(fit_point, tasks, chunksize=16)
+        for task, (count, diameter, x) in enumerate(results):
+            row, ft = divmod(task, len(fitted))
+            ft = fitted[ft]
+            points["count"][row, ft] = count
+            points["final_diameter"][row, ft] = diameter
+            points["offsets_start"][row, ft] = start
+            points["offsets_count"][row, ft] = len(x)
+            offsets.append(x)
+            start += len(x)
+            if (task + 1) % 100 == 0 or task + 1 == len(tasks):
+                print("{} / {} fits".format(task + 1, len(tasks)))
+    os.makedirs(directory, exist_ok=True)
+    np.save(os.path.join(directory, "points.npy"), points)
+    np.save(
+        os.path.join(directory, "offsets.npy"),
+        np.concatenate(offsets) if offsets else np.zeros(0),
+    )
+
+
+def decimal_range(first, last, step):
+    # parse through the decimal string so 1.5 here is the same double as 1.5 in JSON
+    count = int(round((last - first) / step)) + 1
+    return [float("{:.6f}".format(first + i * step)) for i in range(count)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build the dies-per-wafer atlas")
+    parser.add_argument("--out", default=ATLAS_DIR)
+    parser.add_argument(
+        "--wafers", type=float, nargs="+", default=[100.0, 150.0, 200.0, 300.0]
+    )
+    parser.add_argument("--edges", type=float, nargs="+", default=[1.0, 2.0, 3.0])
+    parser.add_argument("--spacings", type=float, nargs="+", default=[0.1, 0.2])
+    parser.add_argument("--size-min", type=float, default=1.0)
+    parser.add_argument("--size-max", type=float, default=30.0)
+    parser.add_argument("--size-step", type=float, default=0.5)
+    parser.add_argument(
+        "--fittypes",
+        type=int,
+        default=0b1111,
+        help="bit ft fits fit type ft, any subset of them is served",
+    )
+    parser.add_argument("--symmetric", action="store_true")
+    parser.add_argument("--solver", default="exact")
+    parser.add_argument("--workers", type=int, default=None)
+    args = parser.parse_args()
+    build(
+        args.out,
+        args.wafers,
+        args.edges,
+        args.spacings,
+        decimal_range(args.size_min, args.size_max, args.size_step),
+        fittypes=args.fittypes,
+        symmetric=(args.symmetric,),
+        solver=args.solver,
+        workers=args.workers,
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -1,10 +1,24 @@
+import contextlib
 import json
 import math
+import os
+import threading
 import time
 from abc import ABC
+from concurrent.futures import ProcessPoolExecutor
 
 import numpy as np
-from scipy import optimize
+from scipy import optimize, spatial
+
+
+class TimeBudgetExceeded(Exception):
+    # raised inside the objective to stop an annealing run at its deadline
+    pass
+
+
+class UpperBoundReached(Exception):
+    # raised inside the objective once the die count meets the fit type's upper bound
+    pass
 
 
 class DiesPerWaferCalculator(ABC):
@@ -22,6 +36,13 @@ class DiesPerWaferCalculator(ABC):
         ft_ShiftRows,
         ft_ShiftCols,
         ft_ShiftRot,
+        solver="anneal",
+        kernel="farthest",
+        parallel=False,
+        max_workers=None,
+        starts=1,
+        seed=None,
+        time_budget=None,
     ) -> None:
         super().__init__()
 
@@ -37,6 +58,15 @@ class DiesPerWaferCalculator(ABC):
         self.ft_ShiftRows = ft_ShiftRows
         self.ft_ShiftCols = ft_ShiftCols
         self.ft_ShiftRot = ft_ShiftRot
+        self.solver = solver  # "anneal" or "exact"
+        self.kernel = kernel  # "farthest" (default), "rows", "buffered" or "reference"
+        self.parallel = parallel  # run the enabled fit types in worker processes
+        self.max_workers = max_workers  # None lets the pool use every core
+        self.starts = starts  # independent annealing starts per fit type, best is kept
+        self.seed = seed  # base seed of the starts, None draws a fresh one
+        self.time_budget = (
+            time_budget  # wall-clock seconds for the search, None: no limit
+        )
 
         self.allow_rotation = True
 
@@ -52,6 +82,10 @@ class DiesPerWaferCalculator(ABC):
         self.maxiter_shift1 = 10000
         self.maxiter_shift2 = 60000
 
+        self.initial_temp_warm = 100  # a warm start searches close to its initial point
+
+        self.batch_bytes = 64 * 2**20  # memory bound per chunk of batched evaluations
+
         ewr = self.waferdiameter / 2 - self.edgeexclusionwidth
         self.ewr = ewr
         # %% find best solution
@@ -66,6 +100,41 @@ class DiesPerWaferCalculator(ABC):
             range(-self.Nmax, self.Nmax + 1),
             indexing="ij",
         )  # grid for shift&rotate
+        self.fitnames = (
+            "Uniform Grid",
+            "Shift Rows",
+            "Shift Columns",
+            "Shifted & Rotated",
+        )
+        # scratch arrays of the buffered kernel, per thread so concurrent calculate()
+        # calls don't overwrite each other's, built on first use
+        self.buffers = threading.local()
+        self.bounds = None  # upper bounds on the count per fit type, built on first use
+        self.diagnostics = {
+            "source": None,  # "fit", or where the layout was restored from
+            "spans": {},  # seconds per phase
+            "fit_types": [],  # search record of each enabled fit type
+        }
+
+    @contextlib.contextmanager
+    def span(self, name):
+        # add the wall time of the block to the diagnostics span name
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            spans = self.diagnostics["spans"]
+            spans[name] = spans.get(name, 0.0) + time.perf_counter() - start
+
+    def __getstate__(self):
+        # scratch buffers are rebuilt on demand, don't ship them to worker processes
+        state = self.__dict__.copy()
+        state["buffers"] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.buffers = threading.local()
 
     def CalculatePositions(self, offsets, ft):
         if ft == 0:
@@ -230,7 +299,190 @@ class DiesPerWaferCalculator(ABC):
             )
         )
 
+    def allocatebuffers(self, ft):
+        # constant grids and scratch arrays reused by every buffered evaluation
+        key = "rot" if ft == 3 else "grid"
+        b = getattr(self.buffers, key, None)
+        if b is not None:
+            return b
+        b = {}
+        if ft == 3:
+            N = self.Nmax
+            L = 2 * N + 1
+            shape = (L, L)
+            row = np.arange(-N, N + 1)
+            b["Xoff"] = self.Xoff2.astype(float)
+            b["rows"] = row.astype(float)
+            b["ysk"] = self.yspacing * row
+            b["unique"] = abs(row)  # mirrored flag index, center row unique
+            b["copied"] = np.where(row >= 0, row, -row - 1)  # center row copied
+            for name in ("flags", "xext", "yext", "xoff", "pitch", "Rsum", "notRsum"):
+                b[name] = np.empty(L)
+            for name in ("Y", "Y1", "t"):
+                b[name] = np.empty(L)
+            b["shifted"] = np.empty(L, dtype=bool)
+            b["rotated"] = np.empty(L, dtype=bool)
+        else:
+            shape = (2 * self.Nx + 1, 2 * self.Ny + 1)
+            b["XoffPx"] = self.Xoff * (self.width + self.xspacing)
+            b["YoffPy"] = self.Yoff * (self.height + self.yspacing)
+            for ft_, N in ((1, self.Ny), (2, self.Nx)):
+                line = np.arange(-N, N + 1)
+                b[ft_] = {
+                    "unique": 1 + abs(line),
+                    "copied": np.where(line >= 0, 1 + line, -line),
+                    "flags": np.empty(2 * N + 1),
+                    "shifted": np.empty(2 * N + 1, dtype=bool),
+                }
+            b["Y"] = np.empty(shape)
+            b["Y1"] = np.empty(shape)
+        b["X"] = np.empty(shape)
+        b["X1"] = np.empty(shape)
+        b["V"] = np.empty((4,) + shape)
+        b["inside"] = np.empty((4,) + shape, dtype=bool)
+        b["valid"] = np.empty(shape, dtype=bool)
+        b["PS"] = np.empty(shape)
+        b["far"] = np.empty(shape)
+        b["near"] = np.empty(shape)
+        setattr(self.buffers, key, b)
+        return b
+
+    def squaredcornersbuffered(self, offsets, ft):
+        # squared x of the left/right and y of the lower/upper die edges, written into
+        # preallocated buffers that are overwritten by the next buffered call
+        b = self.allocatebuffers(ft)
+        X, X1 = b["X"], b["X1"]
+        px = self.width + self.xspacing
+        py = self.height + self.yspacing
+        if ft == 3:
+            N = self.Nmax
+            Y, Y1, t = b["Y"], b["Y1"], b["t"]
+            shifted, rotated, flags = b["shifted"], b["rotated"], b["flags"]
+            if self.symmetric:
+                index = b["unique"] if offsets[0] < 0.5 else b["copied"]
+                np.take(offsets, 1 + index, out=flags)
+                np.greater(flags, 0.5, out=shifted)
+                np.take(offsets, N + 2 + index, out=flags)
+                np.greater(flags, 0.5, out=rotated)
+            else:
+                np.greater(offsets[1 : 2 * N + 2], 0.5, out=shifted)
+                np.greater(offsets[2 * N + 2 :], 0.5, out=rotated)
+            xext, yext, xoff, pitch = b["xext"], b["yext"], b["xoff"], b["pitch"]
+            xext.fill(self.width)
+            np.copyto(xext, self.height, where=rotated)
+            yext.fill(self.height)
+            np.copyto(yext, self.width, where=rotated)
+            if self.symmetric:
+                yoffset0 = (offsets[0] > 0.5) * (yext[N] + self.yspacing) / 2
+            else:
+                yoffset0 = offsets[0]
+            np.multiply(xext, -0.5, out=xoff)
+            np.copyto(xoff, self.xspacing / 2, where=shifted)
+            np.add(xext, self.xspacing, out=pitch)
+            Rsum, notRsum = b["Rsum"], b["notRsum"]
+            Rsum[N] = 0
+            np.cumsum(rotated[N:-1], out=Rsum[N + 1 :])
+            np.cumsum(rotated[N - 1 :: -1], out=Rsum[N - 1 :: -1])
+            np.negative(Rsum[:N], out=Rsum[:N])
+            np.subtract(b["rows"], Rsum, out=notRsum)
+            np.add(b["ysk"], yoffset0, out=Y)
+            np.subtract(Y, yext[N] / 2, out=Y)
+            np.multiply(Rsum, self.width, out=t)
+            np.add(Y, t, out=Y)
+            np.multiply(notRsum, self.height, out=t)
+            np.add(Y, t, out=Y)
+            np.multiply(b["Xoff"], pitch, out=X)
+            np.add(X, xoff, out=X)
+            xextent, yextent = xext, yext
+        else:
+            Y, Y1 = b["Y"], b["Y1"]
+            if ft == 0:
+                if self.symmetric:
+                    xoffset = (offsets[0] > 0.5) * px / 2
+                    yoffset = (offsets[1] > 0.5) * py / 2
+                else:
+                    xoffset, yoffset = offsets[0], offsets[1]
+            else:
+                line = b[ft]
+                flags, shifted = line["flags"], line["shifted"]
+                if self.symmetric:
+                    index = line["unique"] if offsets[0] < 0.5 else line["copied"]
+                    np.take(offsets, index, out=flags)
+                    np.greater(flags, 0.5, out=shifted)
+                    shared = (offsets[0] > 0.5) * (py if ft == 1 else px) / 2
+                else:
+                    np.greater(offsets[1:], 0.5, out=shifted)
+                    shared = offsets[0]
+                np.multiply(shifted, px if ft == 1 else py, out=flags)
+                np.divide(flags, 2, out=flags)
+                if ft == 1:
+                    xoffset, yoffset = flags, shared
+                else:
+                    xoffset, yoffset = shared, flags[:, None]
+            np.add(b["XoffPx"], xoffset, out=X)
+            np.subtract(X, self.width / 2, out=X)
+            np.add(b["YoffPy"], yoffset, out=Y)
+            np.subtract(Y, self.height / 2, out=Y)
+            xextent, yextent = self.width, self.height
+        np.add(X, xextent, out=X1)
+        np.add(Y, yextent, out=Y1)
+        np.multiply(X, X, out=X)
+        np.multiply(X1, X1, out=X1)
+        np.multiply(Y, Y, out=Y)
+        np.multiply(Y1, Y1, out=Y1)
+        return X, X1, Y, Y1
+
+    def constructV2Buffered(self, offsets, ft):  # constructV2 into preallocated buffers
+        X, X1, Y, Y1 = self.squaredcornersbuffered(offsets, ft)
+        V = self.allocatebuffers(ft)["V"]
+        np.add(X, Y, out=V[0])
+        np.add(X1, Y, out=V[1])
+        np.add(X, Y1, out=V[2])
+        np.add(X1, Y1, out=V[3])
+        return V
+
+    def farthestbuffered(self, offsets, ft, nearest=False):
+        # distance^2 of the farthest (and nearest) corner of every die. Float addition is
+        # monotonic, so max(x^2) + max(y^2) equals the max over the four corner sums of
+        # constructV2 exactly and the validity test is unchanged
+        b = self.allocatebuffers(ft)
+        X, X1, Y, Y1 = self.squaredcornersbuffered(offsets, ft)
+        if nearest:
+            np.minimum(X, X1, out=b["PS"])
+            np.minimum(Y, Y1, out=b["near"])
+            np.add(b["PS"], b["near"], out=b["near"])
+        np.maximum(X, X1, out=X1)
+        np.add(X1, np.maximum(Y, Y1, out=Y1), out=b["far"])
+        if nearest:
+            return b["far"], b["near"]
+        return b["far"]
+
+    def farthestV2(self, offsets, ft):  # distance^2 of the farthest corner of each die
+        if self.kernel in ("farthest", "rows"):
+            return self.farthestbuffered(offsets, ft)
+        elif self.kernel == "buffered":
+            return self.constructV2Buffered(offsets, ft).max(axis=0)
+        return self.constructV2(offsets, ft).max(axis=0)
+
+    def validbuffered(self, V, ft):
+        b = self.allocatebuffers(ft)
+        np.less_equal(V, self.ewr**2, out=b["inside"])
+        return np.logical_and.reduce(b["inside"], axis=0, out=b["valid"])
+
     def gridwithpartialscore(self, offsets, ft):
+        if self.kernel != "reference":  # the partial score needs every corner
+            V = self.constructV2Buffered(offsets, ft)
+            valid = self.validbuffered(V, ft)
+            PS = self.allocatebuffers(ft)["PS"]
+            np.sqrt(V, out=V)  # only the partial score needs real distances
+            np.subtract(V, self.ewr, out=V)
+            np.maximum(V, 0, out=V)
+            np.sum(V, axis=0, out=PS)
+            np.divide(PS, 4, out=PS)
+            np.divide(PS, (self.width**2 + self.height**2) ** 0.5, out=PS)
+            np.subtract(1, PS, out=PS)
+            np.copyto(PS, -np.inf, where=valid)
+            return -(np.count_nonzero(valid) + PS.max())
         V = self.constructV2(offsets, ft)
         valid = np.all(V <= self.ewr**2, axis=0)
         PS = (
@@ -243,218 +495,1226 @@ class DiesPerWaferCalculator(ABC):
         return -(valid.sum() + partial_score)
 
     def countfulldies(self, offsets, ft):
+        if self.kernel == "rows":
+            return -self.linecountsbatch(offsets, ft).sum()
+        elif self.kernel == "farthest":
+            valid = self.allocatebuffers(ft)["valid"]
+            np.less_equal(self.farthestbuffered(offsets, ft), self.ewr**2, out=valid)
+            return -np.count_nonzero(valid)
+        elif self.kernel == "buffered":
+            V = self.constructV2Buffered(offsets, ft)
+            return -np.count_nonzero(self.validbuffered(V, ft))
         V = self.constructV2(offsets, ft)
         valid = np.all(V <= self.ewr**2, axis=0)
         return -valid.sum()
 
-    def Rmax(self, offsets, ft, validmask):
-        if self.fittype == 0:
-            V = self.constructV2(offsets, ft)
+    def shiftlines(self, offsets, ft):
+        # per-line half-pitch shift flags (M, 2*N+1) and shared offset (M,) for ft=1/2
+        N = self.Ny if ft == 1 else self.Nx
+        line = np.arange(-N, N + 1)
+        if self.symmetric:
+            unique = offsets[:, :1] < 0.5  # center line unique / copied
+            index = np.where(
+                unique, 1 + abs(line), np.where(line >= 0, 1 + line, -line)
+            )
+            shifted = np.take_along_axis(offsets, index, axis=1) > 0.5
+            shared = (
+                (offsets[:, 0] > 0.5)
+                * (
+                    self.height + self.yspacing
+                    if ft == 1
+                    else self.width + self.xspacing
+                )
+                / 2
+            )
+        else:
+            shifted = offsets[:, 1:] > 0.5
+            shared = offsets[:, 0]
+        return shifted, shared
+
+    def shiftrotrows(self, offsets):
+        # per-row x offset, x extent, y corner and y extent (each (M, 2*Nmax+1)) for ft=3
+        M = len(offsets)
+        N = self.Nmax
+        if self.symmetric:
+            row = np.arange(-N, N + 1)
+            unique = offsets[:, :1] < 0.5  # center row unique / copied
+            index = np.where(unique, abs(row), np.where(row >= 0, row, -row - 1))
+            xshifted_bool = np.take_along_axis(offsets, 1 + index, axis=1) > 0.5
+            rotated_bool = np.take_along_axis(offsets, N + 2 + index, axis=1) > 0.5
+            yoffset0 = (
+                (offsets[:, 0] > 0.5)
+                * (
+                    self.height * ~rotated_bool[:, N]
+                    + self.width * rotated_bool[:, N]
+                    + self.yspacing
+                )
+                / 2
+            )
         else:
-            self.offsets_test[0] = offsets  # just 1 offset
-            V = self.constructV2(self.offsets_test, ft)
-        return V[validmask].max()
+            xshifted_bool = offsets[:, 1 : 2 * N + 2] > 0.5
+            rotated_bool = offsets[:, 2 * N + 2 :] > 0.5
+            yoffset0 = offsets[:, 0]
+        xextent = ~rotated_bool * self.width + rotated_bool * self.height
+        yextent = rotated_bool * self.width + ~rotated_bool * self.height
+        xoffset0 = xshifted_bool * self.xspacing / 2 - ~xshifted_bool * xextent / 2
+        Rsum = np.zeros((M, 2 * N + 1))
+        Rsum[:, N + 1 :] = rotated_bool[:, N:-1].cumsum(axis=1)
+        Rsum[:, :N] = -np.flip(
+            np.flip(rotated_bool[:, :N], axis=1).cumsum(axis=1), axis=1
+        )
+        notRsum = np.arange(-N, N + 1) - Rsum
+        yoffsets = (
+            yoffset0[:, None]
+            + self.yspacing * np.arange(-N, N + 1)
+            - yextent[:, N : N + 1] / 2
+            + Rsum * self.width
+            + notRsum * self.height
+        )
+        return xoffset0, xextent, yoffsets, yextent
 
-    def fit(self):
-        if self.searchdepth == 0:
-            maxiter_grid = self.maxiter_grid0
-            maxiter_shift = self.maxiter_shift0
-        elif self.searchdepth == 1:
-            maxiter_grid = self.maxiter_grid1
-            maxiter_shift = self.maxiter_shift1
-        elif self.searchdepth == 2:
-            maxiter_grid = self.maxiter_grid2
-            maxiter_shift = self.maxiter_shift2
-        Nfits = np.zeros(4)
+    def CalculatePositionsBatch(self, offsets, ft):
+        # same as CalculatePositions for an (M, n_params) matrix of offsets; returns
+        # arrays broadcastable to (M, 2*Nx+1, 2*Ny+1), or (M, 2*Nmax+1, 2*Nmax+1) for ft=3
+        if ft == 0:
+            if self.symmetric:
+                xoffset = (offsets[:, 0] > 0.5) * (self.width + self.xspacing) / 2
+                yoffset = (offsets[:, 1] > 0.5) * (self.height + self.yspacing) / 2
+            else:
+                xoffset, yoffset = offsets[:, 0], offsets[:, 1]
+            return (
+                xoffset[:, None, None]
+                + self.Xoff * (self.width + self.xspacing)
+                - self.width / 2,
+                yoffset[:, None, None]
+                + self.Yoff * (self.height + self.yspacing)
+                - self.height / 2,
+                np.full((1, 1, 1), float(self.width)),
+                np.full((1, 1, 1), float(self.height)),
+            )
+        elif ft in (1, 2):
+            shifted, shared = self.shiftlines(offsets, ft)
+            if ft == 1:
+                xoffset = (shifted * (self.width + self.xspacing) / 2)[:, None, :]
+                yoffset = shared[:, None, None]
+            else:
+                xoffset = shared[:, None, None]
+                yoffset = (shifted * (self.height + self.yspacing) / 2)[:, :, None]
+            return (
+                xoffset + self.Xoff * (self.width + self.xspacing) - self.width / 2,
+                yoffset + self.Yoff * (self.height + self.yspacing) - self.height / 2,
+                np.full((1, 1, 1), float(self.width)),
+                np.full((1, 1, 1), float(self.height)),
+            )
+        elif ft == 3:
+            xoffset0, xextent, yoffsets, yextent = self.shiftrotrows(offsets)
+            return (
+                xoffset0[:, None, :]
+                + self.Xoff2 * (xextent + self.xspacing)[:, None, :],
+                yoffsets[:, None, :],
+                xextent[:, None, :],
+                yextent[:, None, :],
+            )
+
+    def constructV2Batch(self, offsets, ft):  # (4, M, ...) corner distances^2
+        Xcorner, Ycorner, Xextent, Yextent = self.CalculatePositionsBatch(offsets, ft)
+        return np.stack(
+            np.broadcast_arrays(
+                Xcorner**2 + Ycorner**2,
+                (Xcorner + Xextent) ** 2 + Ycorner**2,
+                Xcorner**2 + (Ycorner + Yextent) ** 2,
+                (Xcorner + Xextent) ** 2 + (Ycorner + Yextent) ** 2,
+            )
+        )
+
+    def validbatch(self, offsets, ft):  # (M, ...) mask of full dies
+        if self.kernel == "farthest":
+            Xcorner, Ycorner, Xextent, Yextent = self.CalculatePositionsBatch(
+                offsets, ft
+            )
+            far = np.maximum(Xcorner**2, (Xcorner + Xextent) ** 2) + np.maximum(
+                Ycorner**2, (Ycorner + Yextent) ** 2
+            )
+            return far <= self.ewr**2
+        return np.all(self.constructV2Batch(offsets, ft) <= self.ewr**2, axis=0)
+
+    def evaluatebatch(self, score, offsets, ft, chunksize=None, construct=None):
+        # apply score(construct(chunk, ft)) to the rows of an (M, n_params) offset matrix,
+        # chunked so that each constructV2Batch call stays within self.batch_bytes
+        offsets = np.atleast_2d(np.asarray(offsets, dtype=float))
+        construct = construct or self.constructV2Batch
+        if chunksize is None:
+            if ft == 3:
+                cells = (2 * self.Nmax + 1) ** 2
+            else:
+                cells = (2 * self.Nx + 1) * (2 * self.Ny + 1)
+            chunksize = max(1, self.batch_bytes // (cells * 8 * 8))
+        return np.concatenate(
+            [
+                score(construct(offsets[k : k + chunksize], ft))
+                for k in range(0, len(offsets), chunksize)
+            ]
+            or [np.zeros(0)]
+        )
+
+    def countfulldiesbatch(self, offsets, ft, chunksize=None):
+        if self.kernel == "rows":
+            return -self.linecountsbatch(offsets, ft).sum(axis=1)
+        return self.evaluatebatch(
+            lambda valid: -valid.sum(axis=(1, 2)),
+            offsets,
+            ft,
+            chunksize,
+            construct=self.validbatch,
+        )
+
+    def gridwithpartialscorebatch(self, offsets, ft, chunksize=None):
+        def score(V):
+            valid = np.all(V <= self.ewr**2, axis=0)
+            PS = (
+                1
+                - np.sum(np.clip(V**0.5 - self.ewr, 0, np.inf), axis=0)
+                / 4
+                / (self.width**2 + self.height**2) ** 0.5
+            )
+            partial_score = np.where(valid, -np.inf, PS).max(axis=(1, 2))
+            return -(valid.sum(axis=(1, 2)) + partial_score)
+
+        return self.evaluatebatch(score, offsets, ft, chunksize)
+
+    def countline(self, Y2, base, pitch, extent, sub, N):
+        # full dies along a line of dies whose far edge across the line is at distance^2
+        # Y2 and whose die edges along the line are at (base + i*pitch) - sub and that
+        # plus extent, for i in [-N, N]. The end dies follow from the chord half-width
+        # and are then rechecked with the same arithmetic as constructV2, so the count
+        # matches countfulldies exactly
+        r2 = self.ewr**2
+        c = np.sqrt(np.maximum(r2 - Y2, 0))
+        lo = np.maximum(np.ceil((sub - c - base) / pitch), -N)
+        hi = np.minimum(np.floor((sub + c - extent - base) / pitch), N)
+
+        def valid(i):
+            edge = (base + i * pitch) - sub
+            return np.maximum(edge**2, (edge + extent) ** 2) + Y2 <= r2
+
+        hi = np.where(
+            (hi < N) & valid(hi + 1),
+            hi + 1,
+            np.where((hi >= lo) & ~valid(hi), hi - 1, hi),
+        )
+        lo = np.where(
+            (lo > -N) & valid(lo - 1),
+            lo - 1,
+            np.where((hi >= lo) & ~valid(lo), lo + 1, lo),
+        )
+        return np.maximum(hi - lo + 1, 0).astype(int)
+
+    def linecountsbatch(self, offsets, ft, analytic=False):
+        # full dies per row (ft=0,1,3) or per column (ft=2) for an (M, n_params) matrix
+        # of offsets; O(number of lines) per layout with kernel="rows" or analytic=True,
+        # otherwise counted on the full die grid of the kernel
+        offsets = np.atleast_2d(np.asarray(offsets, dtype=float))
+        if self.kernel != "rows" and not analytic:
+            return self.evaluatebatch(
+                lambda valid: valid.sum(axis=2 if ft == 2 else 1),
+                offsets,
+                ft,
+                construct=self.validbatch,
+            )
+        px = self.width + self.xspacing
+        py = self.height + self.yspacing
+        if ft == 3:
+            xoffset0, xextent, yoffsets, yextent = self.shiftrotrows(offsets)
+            Y2 = np.maximum(yoffsets**2, (yoffsets + yextent) ** 2)
+            return self.countline(
+                Y2, xoffset0, xextent + self.xspacing, xextent, 0, self.Nmax
+            )
+        if ft == 0:
+            if self.symmetric:
+                xoffset = (offsets[:, :1] > 0.5) * px / 2
+                yoffset = (offsets[:, 1:2] > 0.5) * py / 2
+            else:
+                xoffset, yoffset = offsets[:, :1], offsets[:, 1:2]
+        else:
+            shifted, shared = self.shiftlines(offsets, ft)
+            if ft == 1:
+                xoffset, yoffset = shifted * px / 2, shared[:, None]
+            else:
+                xoffset, yoffset = shared[:, None], shifted * py / 2
+        if ft == 2:  # columns: x is across the line, y along it
+            Xcorner = (xoffset + np.arange(-self.Nx, self.Nx + 1) * px) - self.width / 2
+            X2 = np.maximum(Xcorner**2, (Xcorner + self.width) ** 2)
+            return self.countline(
+                X2, yoffset, py, self.height, self.height / 2, self.Ny
+            )
+        Ycorner = (yoffset + np.arange(-self.Ny, self.Ny + 1) * py) - self.height / 2
+        Y2 = np.maximum(Ycorner**2, (Ycorner + self.height) ** 2)
+        return self.countline(Y2, xoffset, px, self.width, self.width / 2, self.Nx)
+
+    def exactgridfit(self):
+        # Exact solver for the uniform grid (ft=0). Inside the search box
+        # [0, (width+xspacing)/2] x [0, (height+yspacing)/2] every die keeps the same
+        # farthest corner, so die (i, j) is valid exactly when the offset lies in a disk of
+        # radius ewr. The best offset is the deepest point of that arrangement of circles,
+        # found by sweeping each circle through its intersections with the others.
+        if self.symmetric:  # only 4 distinct layouts
+            candidates = np.array([[0.0, 0.0], [1.0, 0.0], [0.0, 1.0], [1.0, 1.0]])
+            scores = np.array([self.countfulldies(x, 0) for x in candidates])
+            best = scores.argmin()
+            return optimize.OptimizeResult(
+                x=candidates[best],
+                fun=scores[best],
+                nfev=len(candidates),
+                success=True,
+                message="exact enumeration of symmetric grid offsets",
+            )
+
+        r = self.ewr
+        bx = (self.width + self.xspacing) / 2
+        by = (self.height + self.yspacing) / 2
+        i = np.arange(-self.Nx, self.Nx + 1)
+        j = np.arange(-self.Ny, self.Ny + 1)
+        cx = np.where(
+            i >= 0, -(2 * i * bx + self.width / 2), self.width / 2 - 2 * i * bx
+        )
+        cy = np.where(
+            j >= 0, -(2 * j * by + self.height / 2), self.height / 2 - 2 * j * by
+        )
+        CX, CY = (a.ravel() for a in np.meshgrid(cx, cy, indexing="ij"))
+        dmin = np.hypot(CX - np.clip(CX, 0, bx), CY - np.clip(CY, 0, by))
+        dmax = np.hypot(
+            np.maximum(abs(CX), abs(CX - bx)), np.maximum(abs(CY), abs(CY - by))
+        )
+        always = np.sum(dmax <= r)  # dies valid for every offset in the box
+        crossing = (dmin <= r) & (dmax > r)
+        C = np.stack((CX[crossing], CY[crossing]), axis=1)
+
+        points = [np.array([[bx / 2, by / 2]])]
+        depths = [np.zeros(1, dtype=int)]
+        eps = 1e-9 * r
+        for k in range(len(C)):
+            d = C - C[k]
+            dist = np.hypot(d[:, 0], d[:, 1])
+            others = (dist > 0) & (dist < 2 * r)
+            phi = np.arctan2(d[others, 1], d[others, 0])
+            alpha = np.arccos(dist[others] / (2 * r))
+            # arc of circle k inside disk m spans (phi_m - alpha_m, phi_m + alpha_m)
+            starts = (phi - alpha) % (2 * np.pi)
+            ends = np.sort(starts + 2 * alpha)
+            starts = np.sort(starts)
+
+            splits = [phi - alpha, phi + alpha]
+            for edge in (0, bx):
+                h2 = r**2 - (edge - C[k, 0]) ** 2
+                if h2 >= 0:
+                    splits.append(np.arctan2([h2**0.5, -(h2**0.5)], edge - C[k, 0]))
+            for edge in (0, by):
+                h2 = r**2 - (edge - C[k, 1]) ** 2
+                if h2 >= 0:
+                    splits.append(np.arctan2(edge - C[k, 1], [h2**0.5, -(h2**0.5)]))
+            splits = np.sort(np.concatenate(splits) % (2 * np.pi))
+            if splits.size == 0:
+                mids = np.array([0.0, np.pi])
+            else:
+                mids = (splits + np.append(splits[1:], splits[0] + 2 * np.pi)) / 2
+            P = C[k] + r * np.stack((np.cos(mids), np.sin(mids)), axis=1)
+            inbox = (P[:, 0] >= 0) & (P[:, 0] <= bx) & (P[:, 1] >= 0) & (P[:, 1] <= by)
+            mids, P = mids[inbox], P[inbox]
+            depth = (
+                1
+                + np.searchsorted(starts, mids)
+                - np.searchsorted(ends, mids, side="right")
+                + len(ends)
+                - np.searchsorted(ends, mids + 2 * np.pi, side="right")
+            )
+            points.append(P + eps * (C[k] - P) / r)  # step just inside disk k
+            depths.append(depth)
+        points = np.concatenate(points)
+        depths = np.concatenate(depths)
+
+        # confirm the deepest candidates against the reference objective
+        best_x, best_fun, nfev = None, 1, 0
+        for idx in np.argsort(-depths, kind="stable"):
+            if always + depths[idx] <= -best_fun:
+                break
+            x = np.clip(points[idx], 0, [bx, by])
+            fun = self.countfulldies(x, 0)
+            nfev += 1
+            if fun < best_fun:
+                best_x, best_fun = x, fun
+        return optimize.OptimizeResult(
+            x=best_x,
+            fun=best_fun,
+            nfev=nfev,
+            ncircles=len(C),
+            success=True,
+            message="exact breakpoint sweep",
+        )
+
+    def exactshiftfit(self, ft):
+        # Exact solver for Shift Rows (ft=1) and Shift Columns (ft=2). Once the shared
+        # offset across the lines is fixed, each line's half-pitch shift acts on that line
+        # alone, so the best count is the sum of per-line maxima over the two choices. The
+        # shared offset only matters where a die corner crosses the ewr circle, so it is
+        # swept over those breakpoints and the midpoints between them.
+        if ft == 1:  # lines are rows
+            along, across = self.width, self.height
+            along_pitch = self.width + self.xspacing
+            across_pitch = self.height + self.yspacing
+            Nalong, Nlines = self.Nx, self.Ny
+        else:  # lines are columns
+            along, across = self.height, self.width
+            along_pitch = self.height + self.yspacing
+            across_pitch = self.width + self.xspacing
+            Nalong, Nlines = self.Ny, self.Nx
+
+        line = np.arange(-Nlines, Nlines + 1)
+        if self.symmetric:
+            # mirrored lines share one shift flag, so pick each flag on the summed counts
+            shared_candidates = np.array([0.0, 1.0])
+            variables = [abs(line), np.where(line >= 0, line, -line - 1)]
+        else:
+            i = np.arange(-Nalong, Nalong + 1)
+            X = np.abs(np.concatenate((i, i + 0.5))) * along_pitch + along / 2
+            X = np.unique(X[X <= self.ewr])
+            T = (self.ewr**2 - X**2) ** 0.5 - across / 2
+            T = T[T >= 0]
+            breaks = np.concatenate(
+                (
+                    (T[:, None] - line * across_pitch).ravel(),
+                    (-T[:, None] - line * across_pitch).ravel(),
+                    [0, across_pitch / 2],
+                )
+            )
+            breaks = np.unique(breaks[(breaks >= 0) & (breaks <= across_pitch / 2)])
+            shared_candidates = np.sort(
+                np.concatenate((breaks, (breaks[1:] + breaks[:-1]) / 2))
+            )
+            variables = [line + Nlines] * len(shared_candidates)
+
+        offsets = np.zeros(
+            (len(shared_candidates), Nlines + 2 if self.symmetric else 2 * Nlines + 2)
+        )
+        offsets[:, 0] = shared_candidates
+        # counted per line whatever the kernel: the grid would cost O(Nx * Ny) for
+        # every candidate, and there are O(Nx * Ny) candidates
+        counts0 = self.linecountsbatch(offsets, ft, analytic=True)
+        offsets[:, 1:] = 1
+        counts1 = self.linecountsbatch(offsets, ft, analytic=True)
 
+        best_x, best_fun = None, 1
+        for k, var in enumerate(variables):
+            line0 = np.bincount(var, weights=counts0[k])
+            line1 = np.bincount(var, weights=counts1[k])
+            fun = -np.maximum(line0, line1).sum()
+            if fun < best_fun:
+                best_fun = fun
+                best_x = np.concatenate(
+                    ([shared_candidates[k]], (line1 > line0).astype(float))
+                )
+        return optimize.OptimizeResult(
+            x=best_x,
+            fun=self.countfulldies(best_x, ft),
+            nfev=2 * len(shared_candidates) + 1,
+            success=True,
+            message="exact line decomposition",
+        )
+
+    def exactshiftrotfit(self, deadline=None):
+        # Exact dynamic-programming solver for Shift & Rotate Rows (ft=3). For a given
+        # center-row offset and orientation, rows are stacked outward from the center row
+        # and the bottom of row m only depends on how many of the rows below it are
+        # rotated, so the state is (m, number of rotated rows) and each row picks its
+        # rotation, then its half-pitch shift independently. The center-row offset is
+        # swept over the midpoints between the breakpoints where a die corner of any
+        # reachable row state crosses the ewr circle.
+        # Cost, for M <= Nmax rows that can reach the wafer on each side of the center
+        # row: row m has m states and O(Nmax) die corners, so there are O(Nmax * M**2)
+        # breakpoints, of which the C that fall in the search range are kept. The DP
+        # costs O(M**2) per candidate, O(C * M**2) = O(Nmax * M**4) time in all. Memory
+        # is O(C) for the candidates plus O(chunk * M) for the DP, and the rotation
+        # choices (O(M**2)) are only recorded for the single winning offset.
+        # Past the deadline the sweep stops after the current chunk of offsets and the
+        # best layout so far is returned with fit.finished False.
+        w, h, xs, ys = self.width, self.height, self.xspacing, self.yspacing
+        N = self.Nmax
+        extents = ((h, w), (w, h))  # (yextent, xextent) for not rotated / rotated
+        finished = True  # False once the deadline stops the sweep early
+
+        def bestrow(ybottom, rotated):
+            ye, xe = extents[rotated]
+            Y2 = np.maximum(ybottom**2, (ybottom + ye) ** 2)
+            counts = [
+                self.countline(Y2, base, xe + xs, xe, 0, N)
+                for base in (-xe / 2, xs / 2)
+            ]  # die edges at -xe/2 + i*pitch (centered) or xs/2 + i*pitch (shifted)
+            return np.maximum(*counts), counts[1] > counts[0]
+
+        def stack(base, record=False):
+            # best count of rows 1..N stacked outward from a center row whose outer
+            # edge is at `base` (row m's bottom is base + m*ys + heights of rows 1..m-1)
+            V = np.zeros((len(base), 1))
+            took_rot = []
+            for m in range(1, N + 1):
+                a = np.arange(m)  # rotated rows among rows 1..m-1
+                ybottom = base[:, None] + m * ys + a * w + (m - 1 - a) * h
+                if ybottom.min() > self.ewr:
+                    break
+                stay = np.full((len(base), m + 1), -np.inf)
+                turn = np.full((len(base), m + 1), -np.inf)
+                stay[:, :m] = V + bestrow(ybottom, 0)[0]
+                turn[:, 1:] = V + bestrow(ybottom, 1)[0]
+                if record:
+                    took_rot.append(turn > stay)
+                V = np.maximum(stay, turn)
+            if not record:
+                return V.max(axis=1)
+            # walk the recorded choices back from the best final state
+            a = V[0].argmax()
+            rotated = np.zeros(N, dtype=bool)
+            for m in range(len(took_rot), 0, -1):
+                rotated[m - 1] = took_rot[m - 1][0, a]
+                a -= rotated[m - 1]
+            ye, xe = np.where(rotated, w, h), np.where(rotated, h, w)
+            ybottom = base[0] + ys * np.arange(1, N + 1)
+            ybottom[1:] += ye[:-1].cumsum()
+            Y2 = np.maximum(ybottom**2, (ybottom + ye) ** 2)
+            shifted = self.countline(Y2, xs / 2, xe + xs, xe, 0, N) > self.countline(
+                Y2, -xe / 2, xe + xs, xe, 0, N
+            )
+            return rotated, shifted
+
+        if self.symmetric:
+            # center row unique (flag 0) or copied (flag 1); the lower half mirrors the
+            # upper half, so only the upper stack is searched
+            candidates = []
+            for flag in (0, 1):
+                for r0 in (0, 1):
+                    ye0 = extents[r0][0]
+                    y0 = flag * (ye0 + ys) / 2
+                    row0 = bestrow(np.array([y0 - ye0 / 2]), r0)[0][0]
+                    up = stack(np.array([y0 + ye0 / 2]))[0]
+                    total = row0 + 2 * up if flag == 0 else 2 * (row0 + up)
+                    candidates.append((total, flag, r0, y0))
+            _, flag, r0, y0 = max(candidates, key=lambda c: c[0])
+        else:
+            D = (max(w, h) + ys) / 2  # any stack can be re-indexed into [0, D]
+            best = (-1, None, None)
+            for r0 in (0, 1):
+                ye0 = extents[r0][0]
+                breaks = [np.array([0, D])]
+                for rotated in (0, 1):
+                    ye, xe = extents[rotated]
+                    p = xe + xs
+                    X = np.concatenate(
+                        [
+                            np.abs(shift * p / 2 + np.arange(-N, N + 1) * p) + xe / 2
+                            for shift in (0, 1)
+                        ]
+                    )
+                    T = np.sqrt(self.ewr**2 - X[X <= self.ewr] ** 2)
+                    targets = np.concatenate((T, -T, T - ye, -T - ye))
+                    if rotated == r0:  # center row
+                        breaks.append(targets + ye0 / 2)
+                    for m in range(1, N + 1):
+                        a = np.arange(m)
+                        const = ye0 / 2 + m * ys + a * w + (m - 1 - a) * h
+                        if const.min() - D > self.ewr:
+                            break
+                        # upward stack y0 = targets - const, downward the negation;
+                        # only the O(Nmax * m) values that land in [0, D] are kept
+                        up = (targets[:, None] - const).ravel()
+                        breaks.append(
+                            np.unique(
+                                np.concatenate(
+                                    (
+                                        up[(up >= 0) & (up <= D)],
+                                        -up[(up <= 0) & (up >= -D)],
+                                    )
+                                )
+                            )
+                        )
+                breaks = np.unique(np.concatenate(breaks))
+                breaks = breaks[(breaks >= 0) & (breaks <= D)]
+                y0s = np.concatenate(((breaks[1:] + breaks[:-1]) / 2, [0, D]))
+                # small chunks keep the DP temporaries small enough to be reused
+                # by the allocator instead of being mapped in afresh per row
+                for chunk in range(0, len(y0s), 256):
+                    y0 = y0s[chunk : chunk + 256]
+                    total = (
+                        bestrow(y0 - ye0 / 2, r0)[0]
+                        + stack(y0 + ye0 / 2)
+                        + stack(ye0 / 2 - y0)
+                    )
+                    if total.max() > best[0]:
+                        best = (total.max(), r0, y0[total.argmax()])
+                    if deadline is not None and time.time() > deadline:
+                        finished = False  # best of the offsets swept so far
+                        break
+                if not finished:
+                    break
+            _, r0, y0 = best
+
+        ye0 = extents[r0][0]
+        shifted0 = bestrow(np.array([y0 - ye0 / 2]), r0)[1][0]
+        up_rotated, up_shifted = stack(np.array([y0 + ye0 / 2]), record=True)
+        if self.symmetric:
+            x = np.concatenate(([flag, shifted0], up_shifted, [r0], up_rotated)).astype(
+                float
+            )
+        else:
+            down_rotated, down_shifted = stack(np.array([ye0 / 2 - y0]), record=True)
+            x = np.concatenate(
+                (
+                    [y0],
+                    np.flip(down_shifted),
+                    [shifted0],
+                    up_shifted,
+                    np.flip(down_rotated),
+                    [r0],
+                    up_rotated,
+                )
+            ).astype(float)
+        fit = optimize.OptimizeResult(
+            x=x,
+            fun=self.countfulldies(x, 3),
+            success=True,
+            message=(
+                "exact row-stack dynamic program"
+                if finished
+                else "Time budget exhausted"
+            ),
+        )
+        fit.finished = finished
+        return fit
+
+    def fitphase(
+        self,
+        ft,
+        maxiter_grid,
+        maxiter_shift,
+        seed=None,
+        budget=None,
+        target=None,
+        x0=None,
+    ):
+        # run the search for a single fit type, returns (fit, elapsed seconds)
+        # kept self-contained so fit() can hand it to a worker process
+        # seed=None keeps the unseeded annealing, an int makes the run reproducible
+        # budget is the wall-clock seconds annealing may take, None for no limit
+        # target is an upper bound on the die count, annealing stops when it is met
+        # x0 is the initial point of the annealing, None for a random one
         start = time.time()
-        start2 = start
-        if self.ft_grid:
+        deadline = None if budget is None else start + budget
+        kwargs = (
+            {} if x0 is None else {"x0": x0, "initial_temp": self.initial_temp_warm}
+        )
+        if self.solver == "exact":
+            if ft == 0:
+                fit = self.exactgridfit()
+            elif ft == 3:
+                fit = self.exactshiftrotfit(deadline)
+            else:
+                fit = self.exactshiftfit(ft)
+            if ft != 3:
+                fit.finished = True  # the grid and shift solvers always complete
+        elif ft == 0:
             if self.symmetric:
                 # there are literally only 4 solutions in this case, so this is kinda dumb
-                fit0 = optimize.dual_annealing(
+                fit = self.anneal(
                     self.countfulldies,
-                    [(0, 1), (0, 1)],
-                    args=(0,),
+                    self.annealbounds(0),
+                    0,
+                    seed,
+                    deadline,
+                    target,
                     maxiter=maxiter_grid,
+                    **kwargs,
                 )
             else:
-                fit0 = optimize.dual_annealing(
+                fit = self.anneal(
                     self.gridwithpartialscore,
-                    [
-                        (0, (self.width + self.xspacing) / 2),
-                        (0, (self.height + self.yspacing) / 2),
-                    ],
-                    args=(0,),
+                    self.annealbounds(0),
+                    0,
+                    seed,
+                    deadline,
+                    target,
                     maxiter=maxiter_grid,
+                    **kwargs,
                 )
-            print("Uniform Grid fit output:")
-            print(fit0)
-            print("Uniform Grid time: {:.2f} sec".format(time.time() - start2))
-            Nfits[0] = math.floor(-fit0.fun)
-            start2 = time.time()
-        if self.ft_ShiftRows:
+        else:
+            fit = self.anneal(
+                self.countfulldies,
+                self.annealbounds(ft),
+                ft,
+                seed,
+                deadline,
+                target,
+                maxiter=maxiter_shift,
+                no_local_search=self.no_local_search_shift,
+                **kwargs,
+            )
+        return fit, time.time() - start
+
+    def anneal(self, objective, bounds, ft, seed, deadline, target=None, **kwargs):
+        # dual_annealing that returns the best point evaluated so far once the deadline
+        # passes or the die count reaches target (an upper bound, so nothing better
+        # exists), with fit.finished telling whether the search completed. The
+        # callback only fires on new minima, so the objective also checks the clock.
+        # fit.eval_seconds is the time spent in the objective itself
+        best = {"x": None, "fun": np.inf, "nfev": 0, "seconds": 0.0}
+        stopped = []
+
+        def budgeted(x, ft):
+            if best["x"] is not None:
+                if target is not None and math.floor(-best["fun"]) >= target:
+                    raise UpperBoundReached
+                if deadline is not None and time.time() > deadline:
+                    raise TimeBudgetExceeded
+            begin = time.perf_counter()
+            f = objective(x, ft)
+            best["seconds"] += time.perf_counter() - begin
+            best["nfev"] += 1
+            if f < best["fun"]:
+                best["x"], best["fun"] = np.copy(x), f
+            return f
+
+        def callback(x, f, context):
+            if deadline is not None and time.time() > deadline:
+                stopped.append(True)
+                return True  # stop the annealing
+            return False
+
+        try:
+            fit = optimize.dual_annealing(
+                budgeted, bounds, args=(ft,), seed=seed, callback=callback, **kwargs
+            )
+            fit.finished = not stopped
+        except (TimeBudgetExceeded, UpperBoundReached) as stop:
+            reached = isinstance(stop, UpperBoundReached)
+            fit = optimize.OptimizeResult(
+                x=best["x"],
+                fun=best["fun"],
+                nfev=best["nfev"],
+                success=reached,
+                message=["Upper bound reached" if reached else "Time budget exhausted"],
+            )
+            fit.finished = reached  # reaching the bound proves the search is done
+        fit.eval_seconds = best["seconds"]
+        return fit
+
+    def remainingbudget(self, start, jobs_left):
+        # equal share of the unspent time budget for the next of jobs_left searches
+        if self.time_budget is None:
+            return None
+        return max(0.0, start + self.time_budget - time.time()) / jobs_left
+
+    def startseeds(self, ft, seed):
+        # seeds of the independent annealing starts for fit type ft from the base seed
+        if self.solver == "exact" or (self.starts == 1 and seed is None):
+            return [None]  # deterministic, or a single unseeded run as before
+        # each fit type gets its own stream, so adding or dropping fit types doesn't
+        # change the seeds of the others
+        stream = np.random.SeedSequence(seed).spawn(4)[ft]
+        return [int(child.generate_state(1)[0]) for child in stream.spawn(self.starts)]
+
+    def enabledfittypes(self):
+        return [
+            ft
+            for ft, on in enumerate(
+                (self.ft_grid, self.ft_ShiftRows, self.ft_ShiftCols, self.ft_ShiftRot)
+            )
+            if on
+        ]
+
+    def upperbounds(self):
+        # upper bound on the full dies each fit type can reach, cached. Every die
+        # grown by half the spacing on each side is disjoint from the others and lies
+        # in the disk grown by half the spacing diagonal, which bounds all fit types by
+        # area. Rows (Uniform Grid, Shift Rows) and columns (Uniform Grid, Shift
+        # Columns) also get the tighter line bound
+        if self.bounds is None:
+            margin = math.hypot(self.xspacing, self.yspacing) / 2
+            cell = min(
+                (self.width + self.xspacing) * (self.height + self.yspacing),
+                (self.height + self.xspacing) * (self.width + self.yspacing),
+            )
+            area = math.floor(math.pi * (self.ewr + margin) ** 2 / cell)
+            rows = min(area, self.linebound(1))
+            cols = min(area, self.linebound(2))
+            self.bounds = [min(rows, cols), rows, cols, area]
+        return self.bounds
+
+    def linebound(self, ft):
+        # max over the shared offset of the sum over lines (rows for ft=1, columns for
+        # ft=2) of the most dies that fit in each line, whatever their shift. A line
+        # centered at c holds k dies when the chord at its outer edge spans them:
+        # |c| <= T_k = sqrt(r^2 - ((k*pitch - spacing)/2)^2) - across/2. Each (line, k)
+        # thus covers an interval of offsets, and the bound is the deepest overlap
+        r = self.ewr
+        if ft == 1:
+            along, spacing = self.width, self.xspacing
+            across, across_pitch = self.height, self.height + self.yspacing
+        else:
+            along, spacing = self.height, self.yspacing
+            across, across_pitch = self.width, self.width + self.xspacing
+        pitch = along + spacing
+        k = np.arange(1, math.floor((2 * r + spacing) / pitch) + 1)
+        T = np.sqrt(r**2 - ((k * pitch - spacing) / 2) ** 2) - across / 2
+        T = T[T >= 0]
+        if T.size == 0:
+            return 0
+        N = math.ceil(r / across_pitch) + 1
+        line = np.arange(-N, N + 1)[:, None] * across_pitch
+        eps = 1e-9 * r  # never undercut a die that sits exactly on the edge
+        lo = np.maximum(-T - eps - line, 0).ravel()
+        hi = np.minimum(T + eps - line, across_pitch / 2).ravel()
+        keep = lo <= hi
+        edges = np.concatenate((lo[keep], hi[keep]))
+        steps = np.concatenate((np.ones(keep.sum()), -np.ones(keep.sum())))
+        order = np.lexsort((-steps, edges))  # closed intervals: starts before ends
+        return int(np.cumsum(steps[order]).max())
+
+    def annealbounds(self, ft):
+        # search bounds of the grid offsets, and of the shift fit types: offset along
+        # the shared axis, then flags
+        if ft == 0:
             if self.symmetric:
-                fit1 = optimize.dual_annealing(
-                    self.countfulldies,
-                    [(0, 1)] + [(0, 1) for _ in range(0, self.Ny + 1)],
-                    args=(1,),
-                    maxiter=maxiter_shift,
-                    no_local_search=self.no_local_search_shift,
-                )
-            else:
-                fit1 = optimize.dual_annealing(
-                    self.countfulldies,
-                    [(0, (self.height + self.yspacing) / 2)]
-                    + [(0, 1) for _ in range(-self.Ny, self.Ny + 1)],
-                    args=(1,),
-                    maxiter=maxiter_shift,
-                    no_local_search=self.no_local_search_shift,
+                return [(0, 1), (0, 1)]
+            return [
+                (0, (self.width + self.xspacing) / 2),
+                (0, (self.height + self.yspacing) / 2),
+            ]
+        if self.symmetric:
+            Nflags = {1: self.Ny + 1, 2: self.Nx + 1, 3: 2 * self.Nmax + 2}[ft]
+            return [(0, 1)] + [(0, 1) for _ in range(Nflags)]
+        if ft == 1:
+            return [(0, (self.height + self.yspacing) / 2)] + [
+                (0, 1) for _ in range(-self.Ny, self.Ny + 1)
+            ]
+        elif ft == 2:
+            return [(0, (self.width + self.xspacing) / 2)] + [
+                (0, 1) for _ in range(-self.Nx, self.Nx + 1)
+            ]
+        return [(0, (max((self.height, self.width)) + self.xspacing) / 2)] + [
+            (0, 1) for _ in range(4 * self.Nmax + 2)
+        ]
+
+    def warmstart(self, ft, x0=None, grid=None):
+        # initial point of the annealing for fit type ft: x0[ft] when given, else the
+        # grid offsets carried over to a shift fit type, else None for a random start.
+        # A grid is a shift layout with every line shifted alike: its offset across the
+        # lines is the shared offset, and its offset along them becomes the flags
+        bounds = np.array(self.annealbounds(ft))
+        if x0 is not None and x0[ft] is not None:
+            start = np.asarray(x0[ft], dtype=float)
+            if start.shape != (len(bounds),):
+                raise ValueError(
+                    "x0 of {} has {} offsets, expected {}".format(
+                        self.fitnames[ft], start.size, len(bounds)
+                    )
                 )
-            print("Shift Rows fit output:")
-            print(fit1)
-            print("Shift Rows time: {:.2f} sec".format(time.time() - start2))
-            Nfits[1] = math.floor(-fit1.fun)
-            start2 = time.time()
-        if self.ft_ShiftCols:
+        elif grid is not None and ft > 0:
             if self.symmetric:
-                fit2 = optimize.dual_annealing(
-                    self.countfulldies,
-                    [(0, 1)] + [(0, 1) for _ in range(0, self.Nx + 1)],
-                    args=(2,),
-                    maxiter=maxiter_shift,
-                    no_local_search=self.no_local_search_shift,
-                )
+                xflag, yflag = grid  # already flags
             else:
-                fit2 = optimize.dual_annealing(
-                    self.countfulldies,
-                    [(0, (self.width + self.xspacing) / 2)]
-                    + [(0, 1) for _ in range(-self.Nx, self.Nx + 1)],
-                    args=(2,),
-                    maxiter=maxiter_shift,
-                    no_local_search=self.no_local_search_shift,
-                )
-            print("Shift Columns fit output:")
-            print(fit2)
-            print("Shift Columns time: {:.2f} sec".format(time.time() - start2))
-            Nfits[2] = math.floor(-fit2.fun)
-            start2 = time.time()
-        if self.ft_ShiftRot:
-            if self.symmetric:
-                fit3 = optimize.dual_annealing(
-                    self.countfulldies,
-                    [(0, 1)] + [(0, 1) for _ in range(2 * self.Nmax + 2)],
-                    args=(3,),
-                    maxiter=maxiter_shift,
-                    no_local_search=self.no_local_search_shift,
-                )
+                xflag = 0.75 if grid[0] > (self.width + self.xspacing) / 4 else 0.25
+                yflag = 0.75 if grid[1] > (self.height + self.yspacing) / 4 else 0.25
+            shared, flag = (grid[0], yflag) if ft == 2 else (grid[1], xflag)
+            Nflags = len(bounds) - 1
+            if ft == 3:  # shifted like the grid, none rotated
+                flags = [flag] * (Nflags // 2) + [0.25] * (Nflags // 2)
             else:
-                fit3 = optimize.dual_annealing(
-                    self.countfulldies,
-                    [(0, (max((self.height, self.width)) + self.xspacing) / 2)]
-                    + [(0, 1) for _ in range(4 * self.Nmax + 2)],
-                    args=(3,),
-                    maxiter=maxiter_shift,
-                    no_local_search=self.no_local_search_shift,
+                flags = [flag] * Nflags
+            start = np.array([shared] + flags)
+        else:
+            return None
+        return np.clip(start, bounds[:, 0], bounds[:, 1])
+
+    def fit(self, x0=None):
+        # calculate() with the result kept on the calculator, which then reads like its
+        # FitResult. Not reentrant: concurrent requests should share one calculator
+        # through calculate() instead
+        for name, value in vars(self.calculate(x0)).items():
+            if name != "calculator":
+                setattr(self, name, value)
+
+    def calculate(self, x0=None):
+        # search every enabled fit type and return the best layout as a FitResult.
+        # Only reads the calculator (the bounds cache is filled with the same value by
+        # any thread), so threads can run it concurrently on one instance and share its
+        # grids and bounds.
+        # x0: optional initial offsets of the annealing per fit type, a list of four
+        # arrays or None. Without one, the serial path starts the shift fit types from
+        # the Uniform Grid result
+        if self.searchdepth == 0:
+            maxiter_grid = self.maxiter_grid0
+            maxiter_shift = self.maxiter_shift0
+        elif self.searchdepth == 1:
+            maxiter_grid = self.maxiter_grid1
+            maxiter_shift = self.maxiter_shift1
+        elif self.searchdepth == 2:
+            maxiter_grid = self.maxiter_grid2
+            maxiter_shift = self.maxiter_shift2
+        Nfits = np.full(4, -1.0)  # disabled and pruned fit types never win
+        start = time.time()
+        run = FitResult(self)
+        run.diagnostics["source"] = "fit"
+        search_start = time.perf_counter()
+        bounds = self.upperbounds()
+        incumbent = [-1]  # best count so far, read lazily by the serial path
+        enabled = self.enabledfittypes()
+        fits = [None, None, None, None]
+        run.fitoffsets = [None, None, None, None]  # best offsets of each fit type
+        run.fitnfev = [0, 0, 0, 0]  # objective evaluations of each fit type
+        run.seed = self.seed
+        if self.starts > 1 and run.seed is None:
+            # draw a base seed so a multi-start run can always be reproduced
+            run.seed = int(np.random.SeedSequence().generate_state(1)[0])
+        seeds = [self.startseeds(ft, run.seed) for ft in range(4)]
+        jobs = [(ft, seed) for ft in enabled for seed in seeds[ft]]
+        if (self.parallel or self.starts > 1) and len(jobs) > 1:
+            # fit types and starts are independent, so run them side by side in worker
+            # processes. The grid still goes first, so the shift fit types start from
+            # its offsets and the same seed gives the same layout as the serial path
+            grid_jobs = [job for job in jobs if job[0] == 0]
+            shift_jobs = [job for job in jobs if job[0] != 0]
+            with ProcessPoolExecutor(max_workers=self.max_workers) as pool:
+                budget = None
+                if self.time_budget is not None:
+                    # jobs beyond the worker count queue, so split the budget in waves
+                    workers = self.max_workers or os.cpu_count() or 1
+                    waves = math.ceil(len(grid_jobs) / workers) + math.ceil(
+                        len(shift_jobs) / workers
+                    )
+                    budget = self.time_budget / waves
+
+                def submit(ft, seed, grid=None):
+                    return pool.submit(
+                        self.fitphase,
+                        ft,
+                        maxiter_grid,
+                        maxiter_shift,
+                        seed,
+                        budget,
+                        bounds[ft],
+                        self.warmstart(ft, x0, grid),
+                    )
+
+                grid_futures = [submit(ft, seed) for ft, seed in grid_jobs]
+                grid_phases = [future.result() for future in grid_futures]
+                grid, count = None, -1
+                if grid_phases:
+                    # best of the starts, ties go to the first start
+                    grid = min(grid_phases, key=lambda phase: phase[0].fun)[0]
+                    count = math.floor(-grid.fun)
+                futures = [
+                    # pruned like the serial path, against the grid count
+                    (
+                        None
+                        if bounds[ft] <= count
+                        else submit(ft, seed, None if grid is None else grid.x)
+                    )
+                    for ft, seed in shift_jobs
+                ]
+                phases = iter(
+                    grid_phases
+                    + [
+                        None if future is None else future.result()
+                        for future in futures
+                    ]
+                )
+        else:
+            # lazy, so each phase gets an equal share of what is left of the budget
+            # when it starts, and is skipped when its upper bound can't beat the
+            # incumbent (ties go to the earlier fit type).
+            # The grid is fitted first, so its offsets can seed the later fit types
+            phases = (
+                (
+                    None
+                    if bounds[ft] <= incumbent[0]
+                    else self.fitphase(
+                        ft,
+                        maxiter_grid,
+                        maxiter_shift,
+                        seed,
+                        self.remainingbudget(start, len(jobs) - n),
+                        bounds[ft],
+                        self.warmstart(ft, x0, None if fits[0] is None else fits[0].x),
+                    )
                 )
-            print("Shifted & Rotated fit output:")
-            print(fit3)
-            print("Shifted & Rotated time: {:.2f} sec".format(time.time() - start2))
-            Nfits[3] = math.floor(-fit3.fun)
-            start2 = time.time()
+                for n, (ft, seed) in enumerate(jobs)
+            )
+        run.fitseeds = [None, None, None, None]  # winning start of each fit type
+        run.finished = True  # False once any search was cut short by the time budget
+        for ft in enabled:
+            runs = [next(phases) for _ in seeds[ft]]
+            record = {
+                "fit_type": ft,
+                "name": self.fitnames[ft],
+                "upper_bound": int(bounds[ft]),
+            }
+            run.diagnostics["fit_types"].append(record)
+            if runs[0] is None:
+                # the bound can't beat the incumbent
+                record["skipped"] = True
+                record["incumbent"] = incumbent[0]
+                continue
+            run.finished &= all(fit_ft.finished for fit_ft, _ in runs)
+            # the Shift & Rotate dynamic program reports no evaluations
+            run.fitnfev[ft] = sum(int(fit_ft.get("nfev", 0)) for fit_ft, _ in runs)
+            # best of the starts, ties go to the first start
+            best = int(np.argmin([fit_ft.fun for fit_ft, _ in runs]))
+            fit_ft = runs[best][0]
+            seconds = sum(elapsed for _, elapsed in runs)
+            # the exact solvers evaluate in batches, so only annealing has a mean cost
+            eval_seconds = sum(fit_ft.get("eval_seconds", np.nan) for fit_ft, _ in runs)
+            message = fit_ft.message
+            record.update(
+                skipped=False,
+                count=math.floor(-fit_ft.fun),
+                starts=len(runs),
+                seed=seeds[ft][best],
+                finished=all(bool(fit_ft.finished) for fit_ft, _ in runs),
+                message="; ".join(message) if isinstance(message, list) else message,
+                seconds=seconds,
+                nfev=run.fitnfev[ft],
+                eval_ms=(
+                    1e3 * eval_seconds / run.fitnfev[ft]
+                    if run.fitnfev[ft] and not math.isnan(eval_seconds)
+                    else None
+                ),
+            )
+            # worker processes overlap, so these can add up to more than "search"
+            run.diagnostics["spans"]["fit." + self.fitnames[ft]] = seconds
+            fits[ft] = fit_ft
+            run.fitoffsets[ft] = np.copy(fit_ft.x)  # centering edits the winner's x
+            run.fitseeds[ft] = seeds[ft][best]
+            Nfits[ft] = math.floor(-fit_ft.fun)
+            incumbent[0] = max(incumbent[0], int(Nfits[ft]))
 
         fittype = (
             Nfits.argmax()
         )  # "indices corresponding to the first occurrence are returned"
-        self.fittype = fittype
-        if fittype == 0:
-            fit = fit0
-        elif fittype == 1:
-            fit = fit1
-        elif fittype == 2:
-            fit = fit2
-        elif fittype == 3:
-            fit = fit3
-        # fit=[fit1,fit2,fit3,fit4][fittype] #doesnt work bc not all fit# defined
+        run.fittype = fittype
+        run.fitseed = run.fitseeds[fittype]
+        fit = fits[fittype]
         end = time.time()
+        run.diagnostics["spans"]["search"] = time.perf_counter() - search_start
         Nfit = math.floor(-fit.fun)
         # %% center solution (if not symmetric)
+        with run.span("centering"):
+            final_offsets, min_diameter = self.center(fit, fittype)
+
+        run.setlayout(final_offsets, fittype, min_diameter)
+        run.Nfit = Nfit
+        run.start = start
+        run.end = end
+        return run
+
+    def center(self, fit, fittype):
+        # offsets and diameter of the smallest wafer holding the valid dies of fit
         fit_offsets = fit.x
-        fit_V = self.constructV2(fit_offsets, fittype)
-        fit_valid = np.tile(
-            np.all(fit_V <= self.ewr**2, axis=0), [4, 1, 1]
-        )  # mask of valid points in V2
+        fit_V = self.farthestV2(fit_offsets, fittype)
+        fit_valid = fit_V <= self.ewr**2  # mask of valid dies
         if self.symmetric:
             final_offsets = fit.x
             min_diameter = 2 * (fit_V[fit_valid].max() ** 0.5 + self.edgeexclusionwidth)
         else:
-            self.offsets_test = fit_offsets
-
-            print("\nCentering output:")
-            if fittype == 0:
-                fit2 = optimize.minimize(
-                    self.Rmax,
-                    fit_offsets,
-                    bounds=[
-                        (0, (self.width + self.xspacing) / 2),
-                        (0, (self.height + self.yspacing) / 2),
-                    ],
-                    args=(fittype, fit_valid),
-                )
-                centered_offsets = fit2.x
-            elif fittype == 1:
-                fit2 = optimize.minimize_scalar(
-                    self.Rmax,
-                    bounds=(0, (self.height + self.yspacing) / 2),
-                    args=(fittype, fit_valid),
+            final_offsets = self.centeredoffsets(fit_offsets, fittype, fit_valid)
+            # radius of the returned layout itself, not of the solver's model of it
+            R2 = self.farthestV2(final_offsets, fittype)[fit_valid].max()
+            min_diameter = 2 * (R2**0.5 + self.edgeexclusionwidth)
+        return final_offsets, min_diameter
+
+    def centeredoffsets(self, offsets, ft, validmask):
+        # offsets of ft that minimize the farthest corner of the valid dies, solved
+        # exactly. Moving by the free offset o, corner k is at distance^2 |o + P_k|^2,
+        # a quadratic in o. The farthest corner from any center is a vertex of the
+        # convex hull of the corners, so only those vertices are kept: the corners of
+        # the first and last valid die of each line, as the dies in between lie on the
+        # segments joining them. Uniform Grid moves in x and y, which makes this the
+        # smallest circle enclosing the vertices. The other fit types move along a
+        # single axis (y, or x for Shift Columns) and give a 1D min-max of parabolas
+        if ft == 0:
+            base = np.zeros(2)
+            upper = np.array(
+                ((self.width + self.xspacing) / 2, (self.height + self.yspacing) / 2)
+            )
+        else:
+            base = np.array(offsets, dtype=float)
+            base[0] = 0
+            pitch = {
+                1: self.height + self.yspacing,
+                2: self.width + self.xspacing,
+                3: max((self.width, self.height)) + self.yspacing,
+            }[ft]
+            upper = pitch / 2
+        Xcorner, Ycorner, Xextent, Yextent = self.CalculatePositions(base, ft)
+        # dies along a line: Shift Columns lines are columns, all others rows
+        axis = 1 if ft == 2 else 0
+        inner = np.zeros_like(validmask)
+        inner[(slice(None),) * axis + (slice(1, -1),)] = (
+            validmask[(slice(None),) * axis + (slice(2, None),)]
+            & validmask[(slice(None),) * axis + (slice(None, -2),)]
+        )
+        ends = validmask & ~inner
+        X = np.broadcast_to(Xcorner, ends.shape)[ends]
+        Y = np.broadcast_to(Ycorner, ends.shape)[ends]
+        XE = np.broadcast_to(Xextent, ends.shape)[ends]
+        YE = np.broadcast_to(Yextent, ends.shape)[ends]
+        P = np.concatenate(
+            (
+                np.stack((X, Y), axis=1),
+                np.stack((X + XE, Y), axis=1),
+                np.stack((X, Y + YE), axis=1),
+                np.stack((X + XE, Y + YE), axis=1),
+            )
+        )
+        P = P[spatial.ConvexHull(P).vertices]
+        centered = np.array(offsets, dtype=float)
+        if ft == 0:
+            centered[:] = self.boxedcenter(P, upper)
+        elif ft == 2:
+            centered[0] = self.minmaxparabolas(P[:, 0], P[:, 1] ** 2, 0, upper)
+        else:
+            centered[0] = self.minmaxparabolas(P[:, 1], P[:, 0] ** 2, 0, upper)
+        return centered
+
+    def boxedcenter(self, P, upper):
+        # offset o in [0, upper] minimizing max_k |o + P_k|^2. Unconstrained, -o is the
+        # center of the smallest enclosing circle. The problem is convex, so when that
+        # center is out of bounds the optimum lies on an edge of the box
+        center = self.enclosingcircle(P)
+        if np.all((-center >= 0) & (-center <= upper)):
+            return -center
+        candidates = []
+        for axis in (0, 1):
+            other = 1 - axis
+            for fixed in (0.0, upper[axis]):
+                t = self.minmaxparabolas(
+                    P[:, other], (fixed + P[:, axis]) ** 2, 0, upper[other]
                 )
-                centered_offsets = fit_offsets
-                centered_offsets[0] = fit2.x
-            elif fittype == 2:
-                fit2 = optimize.minimize_scalar(
-                    self.Rmax,
-                    bounds=(0, (self.width + self.xspacing) / 2),
-                    args=(fittype, fit_valid),
+                o = np.empty(2)
+                o[axis], o[other] = fixed, t
+                candidates.append(o)
+        return min(candidates, key=lambda o: ((o + P) ** 2).sum(axis=1).max())
+
+    def enclosingcircle(self, P):
+        # center of the smallest circle enclosing the points P, by Welzl's randomized
+        # incremental algorithm (expected linear time)
+        P = P[np.random.default_rng(0).permutation(len(P))]  # fixed order, same result
+        scale = np.abs(P).max()
+        eps = 1e-12 * scale**2
+
+        def inside(p, c, r2):
+            return ((p - c) ** 2).sum() <= r2 + eps
+
+        c, r2 = P[0], 0.0
+        for i in range(1, len(P)):
+            if inside(P[i], c, r2):
+                continue
+            c, r2 = P[i], 0.0
+            for j in range(i):
+                if inside(P[j], c, r2):
+                    continue
+                c = (P[i] + P[j]) / 2
+                r2 = ((P[i] - c) ** 2).sum()
+                for k in range(j):
+                    if inside(P[k], c, r2):
+                        continue
+                    c = self.circumcenter(P[i], P[j], P[k])
+                    r2 = ((P[i] - c) ** 2).sum()
+        return c
+
+    def circumcenter(self, a, b, c):
+        # center of the circle through three points; for (nearly) collinear points, of
+        # the circle on the farthest pair
+        b, c = b - a, c - a
+        d = 2 * (b[0] * c[1] - b[1] * c[0])
+        if abs(d) <= 1e-12 * (b**2).sum() ** 0.5 * (c**2).sum() ** 0.5:
+            pairs = ((a, a + b), (a, a + c), (a + b, a + c))
+            p, q = max(pairs, key=lambda pq: ((pq[0] - pq[1]) ** 2).sum())
+            return (p + q) / 2
+        b2, c2 = (b**2).sum(), (c**2).sum()
+        return a + np.array(((c[1] * b2 - b[1] * c2) / d, (b[0] * c2 - c[0] * b2) / d))
+
+    def minmaxparabolas(self, a, c, lo, hi):
+        # t in [lo, hi] minimizing max_k (t + a_k)^2 + c_k = t^2 + max_k (2 a_k t + d_k).
+        # The max of the lines is their upper envelope, so on each envelope segment the
+        # function is one parabola; the minimum is at a parabola vertex inside its
+        # segment, at a breakpoint, or at lo or hi
+        slopes, intercepts = 2 * a, a**2 + c
+        order = np.lexsort((intercepts, slopes))
+        envelope = []  # (slope, intercept), slopes increasing
+        for s, d in zip(slopes[order], intercepts[order]):
+            if envelope and envelope[-1][0] == s:
+                envelope.pop()  # same slope, the larger intercept comes last
+            while len(envelope) >= 2:
+                (s1, d1), (s2, d2) = envelope[-2], envelope[-1]
+                # line 2 is never on top once the new line overtakes line 1 before it
+                if (d1 - d) * (s2 - s1) <= (d1 - d2) * (s - s1):
+                    envelope.pop()
+                else:
+                    break
+            envelope.append((s, d))
+        S, D = np.array(envelope).T
+        breaks = (D[:-1] - D[1:]) / (S[1:] - S[:-1])
+        candidates = np.clip(np.concatenate(([lo, hi], -S / 2, breaks)), lo, hi)
+        values = candidates**2 + (np.outer(candidates, S) + D).max(axis=1)
+        return candidates[values.argmin()]
+
+    def setlayout(self, final_offsets, fittype, final_diameter):
+        # die positions and valid/partial masks of a finished solution
+        # also used to rebuild a layout from stored offsets without fitting
+        with self.span("positions"):
+            self.fittype = fittype
+            self.final_offsets = final_offsets
+            Xcorner, Ycorner, Xextent, Yextent = self.CalculatePositions(
+                final_offsets, fittype
+            )
+            if self.kernel in ("farthest", "rows"):
+                far, near = self.farthestbuffered(final_offsets, fittype, nearest=True)
+                self.valid = far**0.5 <= self.ewr
+                self.partial = np.logical_and(
+                    near**0.5 <= self.ewr, np.logical_not(self.valid)
                 )
-                centered_offsets = fit_offsets
-                centered_offsets[0] = fit2.x
-            elif fittype == 3:
-                fit2 = optimize.minimize_scalar(
-                    self.Rmax,
-                    bounds=(0, (max((self.width, self.height)) + self.yspacing) / 2),
-                    args=(fittype, fit_valid),
+                V2 = None  # the farthest kernel never materializes all four corners
+            else:
+                V2 = self.constructV2(final_offsets, fittype)
+
+                self.valid = np.all(V2**0.5 <= self.ewr, axis=0)
+                self.partial = np.logical_and(
+                    np.any(V2**0.5 <= self.ewr, axis=0), np.logical_not(self.valid)
                 )
-                centered_offsets = fit_offsets
-                centered_offsets[0] = fit2.x
-            print(fit2)
-            final_offsets = centered_offsets
-            min_diameter = 2 * (fit2.fun**0.5 + self.edgeexclusionwidth)
-        print("\nFinal Offsets:")
-        print(final_offsets)
-        print("Solution diameter:")
-        print(min_diameter)
-
-        Xcorner, Ycorner, Xextent, Yextent = self.CalculatePositions(
-            final_offsets, fittype
-        )
-        V2 = self.constructV2(final_offsets, fittype)
 
-        self.valid = np.all(V2**0.5 <= self.ewr, axis=0)
-        self.partial = np.logical_and(
-            np.any(V2**0.5 <= self.ewr, axis=0), np.logical_not(self.valid)
-        )
+            self.final_diameter = final_diameter
+            self.Xcorner = Xcorner.astype(float)
+            self.Ycorner = Ycorner.astype(float)
+            self.Xextent = Xextent.astype(float)
+            self.Yextent = Yextent.astype(float)
+            self.V2 = V2
 
-        self.final_diameter = min_diameter
-        self.Xcorner = Xcorner.astype(float)
-        self.Ycorner = Ycorner.astype(float)
-        self.Xextent = Xextent.astype(float)
-        self.Yextent = Yextent.astype(float)
-        self.Nfit = Nfit
-        self.start = start
-        self.end = end
-        self.V2 = V2
+    def diecornersjson(self, mask):
+        # JSON of the corner points [[x0, y0], [x1, y0], [x1, y1], [x0, y1]] of the masked
+        # dies in np.ndenumerate order, byte-identical to json.dumps of the nested lists.
+        # Dies share a handful of row and column coordinates, so every distinct float is
+        # repr'd once and the text is assembled with a single % format
+        X0 = self.Xcorner[mask]
+        Y0 = self.Ycorner[mask]
+        X1 = X0 + self.Xextent[mask]
+        Y1 = Y0 + self.Yextent[mask]
+        if X0.size == 0:
+            return "[]"
+        corners = np.stack((X0, Y0, X1, Y0, X1, Y1, X0, Y1), axis=1).ravel()
+        # unique on the bit pattern, so -0.0 keeps its sign like repr does
+        bits, inverse = np.unique(corners.view(np.int64), return_inverse=True)
+        text = np.array([repr(v) for v in bits.view(np.float64).tolist()], dtype=object)
+        die = "[[%s, %s], [%s, %s], [%s, %s], [%s, %s]]"
+        return "[" + (", ".join([die] * X0.size) % tuple(text[inverse])) + "]"
 
-    def format_json_obj(self):
+    def json_header(self):
+        # every response key except the die lists, shared by all response encodings
         json_data = {}
         # User inputs
         json_data["user_inputs"] = {
@@ -468,26 +1728,48 @@ class DiesPerWaferCalculator(ABC):
         # Outputs
         json_data["final_wafer_diameter"] = float(self.final_diameter)
         json_data["fit_type"] = int(self.fittype)
+        if self.fitseed is not None:
+            json_data["seed"] = int(self.seed)
+            json_data["winning_seed"] = int(self.fitseed)
+        bound = max(self.upperbounds()[ft] for ft in self.enabledfittypes())
+        json_data["upper_bound"] = int(bound)
+        if self.time_budget is not None:
+            json_data["time_budget"] = float(self.time_budget)
+            json_data["search_finished"] = bool(self.finished)
 
-        partial_dies = []
-        valid_dies = []
-        for idx, _ in np.ndenumerate(self.Xcorner):
-            corner_pts = [
-                [self.Xcorner[idx], self.Ycorner[idx]],
-                [self.Xcorner[idx] + self.Xextent[idx], self.Ycorner[idx]],
-                [
-                    self.Xcorner[idx] + self.Xextent[idx],
-                    self.Ycorner[idx] + self.Yextent[idx],
-                ],
-                [self.Xcorner[idx], self.Ycorner[idx] + self.Yextent[idx]],
-            ]
-            if self.partial[idx]:
-                partial_dies.append(corner_pts)
-            if self.valid[idx]:
-                valid_dies.append(corner_pts)
-        json_data["num_dies"] = len(valid_dies)
-        json_data["valid_dies"] = valid_dies
-        json_data["partial_dies"] = partial_dies
-        print(len(partial_dies))
-        print(len(valid_dies))
-        return json.dumps(json_data)
+        json_data["num_dies"] = int(np.count_nonzero(self.valid))
+        json_data["optimality_gap"] = json_data["upper_bound"] - json_data["num_dies"]
+        return json_data
+
+    def format_json_obj(self):
+        json_data = self.json_header()
+        # the die lists are serialized directly and appended after the other keys
+        return '{}, "valid_dies": {}, "partial_dies": {}}}'.format(
+            json.dumps(json_data)[:-1],
+            self.diecornersjson(self.valid),
+            self.diecornersjson(self.partial),
+        )
+
+
+class FitResult:
+    # Layout found by DiesPerWaferCalculator.calculate(). Holds the outputs of one
+    # search (fittype, final_offsets, valid, partial, Nfit, diagnostics, ...) and reads
+    # the inputs, grids and bounds through from its calculator, so it formats and
+    # serializes like a fitted calculator
+
+    def __init__(self, calculator) -> None:
+        self.calculator = calculator
+        self.diagnostics = {"source": None, "spans": {}, "fit_types": []}
+
+    def __getattr__(self, name):
+        # only reached for names the result doesn't set itself
+        if name.startswith("__"):
+            raise AttributeError(name)  # e.g. pickle probing before calculator is set
+        return getattr(self.calculator, name)
+
+    # the layout and output methods work on the result's own fields
+    span = DiesPerWaferCalculator.span
+    setlayout = DiesPerWaferCalculator.setlayout
+    diecornersjson = DiesPerWaferCalculator.diecornersjson
+    json_header = DiesPerWaferCalculator.json_header
+    format_json_obj = DiesPerWaferCalculator.format_json_obj
@@ -243,10 +243,8 @@ def run_ui():
             button_execute.config(relief="raised")
             return
 
-        valid = np.all(dpw.V2**0.5 <= dpw.ewr, axis=0)
-        partial = np.logical_and(
-            np.any(dpw.V2**0.5 <= dpw.ewr, axis=0), np.logical_not(valid)
-        )
+        valid = dpw.valid
+        partial = dpw.partial
 
         ax.clear()
         title_text = "die number = {:n}   Fit Type = {}{}\nwidth = {:n}   height = {:n}\nx spacing = {:n}   y spacing = {:n}\nwafer diameter = {:n}   edge exclusion = {:n}".format(
@@ -0,0 +1,176 @@
+import threading
+import time
+from collections import OrderedDict
+
+TRANSPOSED_FITTYPE = {0: 0, 1: 2, 2: 1, 3: 3}  # Shift Rows <-> Shift Columns
+
+
+def canonical_length(value):
+    # 12 significant digits, so 20 mm on a 200 mm wafer and 2 cm on a 20 cm wafer agree
+    return float("{:.12g}".format(value))
+
+
+class FitMemo:
+    # In-process LRU memo in front of DiesPerWaferCalculator.fit().
+    # A fit is keyed on its canonical form: all lengths divided by the wafer radius, and
+    # transposed so that (width, xspacing) >= (height, yspacing). The layout is kept at
+    # the scale it was fitted at, so a hit at that scale is bit-exact. Scaling every length
+    # scales the layout, and swapping width<->height and xspacing<->yspacing transposes
+    # it while mapping Shift Rows onto Shift Columns. Shift & Rotate Rows has no
+    # column counterpart, so problems with it enabled are only scale-canonicalized.
+    # Neither are seeded or multi-start annealing runs: Shift Rows and Shift Columns draw
+    # from different seed streams, so a transposed layout is not what the seed gives.
+    # Scaling is exact up to float rounding, so a die sitting exactly on the exclusion
+    # edge may count differently than a fresh fit would
+
+    def __init__(self, maxsize=256) -> None:
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def canonical(self, dpw):
+        # returns (key, scale, transposed) of the calculator's problem
+        scale = dpw.waferdiameter / 2
+        seeded = dpw.solver != "exact" and (dpw.seed is not None or dpw.starts > 1)
+        transposed = (
+            not dpw.ft_ShiftRot
+            and not seeded
+            and (dpw.width, dpw.xspacing) < (dpw.height, dpw.yspacing)
+        )
+        width, height = dpw.width, dpw.height
+        xspacing, yspacing = dpw.xspacing, dpw.yspacing
+        ft_ShiftRows, ft_ShiftCols = dpw.ft_ShiftRows, dpw.ft_ShiftCols
+        if transposed:
+            width, height = height, width
+            xspacing, yspacing = yspacing, xspacing
+            ft_ShiftRows, ft_ShiftCols = ft_ShiftCols, ft_ShiftRows
+        key = (
+            canonical_length(width / scale),
+            canonical_length(height / scale),
+            canonical_length(xspacing / scale),
+            canonical_length(yspacing / scale),
+            canonical_length(dpw.edgeexclusionwidth / scale),
+            bool(dpw.ft_grid),
+            bool(ft_ShiftRows),
+            bool(ft_ShiftCols),
+            bool(dpw.ft_ShiftRot),
+            bool(dpw.symmetric),
+            dpw.searchdepth,
+            dpw.solver,
+            dpw.starts,
+            dpw.seed,
+            dpw.time_budget,
+        )
+        return key, scale, transposed
+
+    def fit(self, dpw, x0=None):
+        # fit dpw, or restore its layout from an equivalent earlier fit
+        # x0 is passed on to dpw.fit(). Returns True on a memo hit
+        key, scale, transposed = self.canonical(dpw)
+        with self.lock:
+            entry = self.entries.get(key)
+            if (
+                entry is not None
+                and entry["transposed"] != transposed
+                and entry["rowcoltie"]
+            ):
+                # ties go to the first fit type, so the transposed problem picks the
+                # other one of Shift Rows/Columns: fit it in its own orientation
+                entry = None
+            if entry is not None:
+                self.entries.move_to_end(key)
+                self.hits += 1
+            else:
+                self.misses += 1
+        if entry is not None:
+            self.restore(dpw, entry, scale, transposed)
+            return True
+        dpw.fit(x0)
+        if not dpw.finished:
+            return False  # cut short by the time budget, a later fit may do better
+        entry = self.transform(
+            {
+                "fittype": int(dpw.fittype),
+                "Xcorner": dpw.Xcorner,
+                "Ycorner": dpw.Ycorner,
+                "Xextent": dpw.Xextent,
+                "Yextent": dpw.Yextent,
+                "valid": dpw.valid,
+                "partial": dpw.partial,
+                "final_diameter": dpw.final_diameter,
+                "fitseeds": list(dpw.fitseeds),
+            },
+            1.0,  # kept at the original scale, so a same-scale hit is bit-exact
+            transposed,
+        )
+        entry["Nfit"] = dpw.Nfit
+        entry["seed"] = dpw.seed
+        entry["scale"] = scale
+        entry["finished"] = dpw.finished
+        entry["transposed"] = transposed
+        entry["rowcoltie"] = self.rowcoltie(dpw)
+        with self.lock:
+            self.entries[key] = entry
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+        return False
+
+    def rowcoltie(self, dpw):
+        # True when the winner is Shift Rows or Shift Columns and the other one may have
+        # reached the same count (a fit type pruned on its upper bound may have too)
+        if dpw.fittype not in (1, 2):
+            return False
+        for record in dpw.diagnostics["fit_types"]:
+            if record["fit_type"] == 3 - dpw.fittype:
+                if record["skipped"]:
+                    return record["upper_bound"] >= dpw.Nfit
+                return record["count"] >= dpw.Nfit
+        return False  # the other one is disabled
+
+    def transform(self, entry, factor, transposed):
+        # scale lengths by factor and optionally transpose; self-inverse up to the factor
+        X, Y = entry["Xcorner"], entry["Ycorner"]
+        XE, YE = entry["Xextent"], entry["Yextent"]
+        valid, partial = entry["valid"], entry["partial"]
+        fitseeds = list(entry["fitseeds"])
+        fittype = entry["fittype"]
+        if transposed:
+            # grid arrays are indexed [x, y], so swap axes along with coordinates
+            X, Y, XE, YE = Y.T, X.T, YE.T, XE.T
+            valid, partial = valid.T, partial.T
+            fitseeds[1], fitseeds[2] = fitseeds[2], fitseeds[1]
+            fittype = TRANSPOSED_FITTYPE[fittype]
+        return {
+            "fittype": fittype,
+            "Xcorner": X * factor,
+            "Ycorner": Y * factor,
+            "Xextent": XE * factor,
+            "Yextent": YE * factor,
+            "valid": valid.copy(),
+            "partial": partial.copy(),
+            "final_diameter": entry["final_diameter"] * factor,
+            "fitseeds": fitseeds,
+        }
+
+    def restore(self, dpw, entry, scale, transposed):
+        layout = self.transform(entry, scale / entry["scale"], transposed)
+        dpw.fittype = layout["fittype"]
+        dpw.fitseeds = layout["fitseeds"]
+        dpw.fitseed = layout["fitseeds"][layout["fittype"]]
+        dpw.seed = entry["seed"]
+        dpw.Xcorner = layout["Xcorner"]
+        dpw.Ycorner = layout["Ycorner"]
+        dpw.Xextent = layout["Xextent"]
+        dpw.Yextent = layout["Yextent"]
+        dpw.valid = layout["valid"]
+        dpw.partial = layout["partial"]
+        dpw.final_diameter = layout["final_diameter"]
+        dpw.Nfit = entry["Nfit"]
+        dpw.finished = entry["finished"]
+        dpw.start = dpw.end = time.time()
+        dpw.V2 = None  # corner distances are not kept, valid and partial are
+        dpw.diagnostics["source"] = "memo"
+        dpw.diagnostics["memo"] = {"scale": scale, "transposed": transposed}
@@ -0,0 +1,228 @@
+import contextlib
+import json
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+
+JOBS_DB = os.environ.get(
+    "DPW_JOBS_DB", os.path.join(tempfile.gettempdir(), "dies_per_wafer_jobs.sqlite3")
+)
+
+JOB_TTL = float(os.environ.get("DPW_JOB_TTL", 3600))  # seconds a finished job is kept
+JOB_RESULT_BYTES = int(os.environ.get("DPW_JOB_RESULT_BYTES", 256 * 2**20))
+
+QUEUED, RUNNING, DONE, FAILED = "queued", "running", "done", "failed"
+
+
+class JobQueue:
+    # Persistent queue of fit requests in a local SQLite file, no broker needed.
+    # The job id is the content address of the request (cache_key), so submitting the
+    # same input again returns the existing job instead of queuing a second fit, unless
+    # that job failed or its search was cut short by the time budget.
+    # Each call opens its own connection, so the queue can be shared by threads and
+    # processes; claiming a job takes the write lock, so a job runs only once.
+    # Finished jobs are evicted after ttl seconds, and the oldest first once their
+    # results add up to more than max_bytes, so the file doesn't grow without bound
+
+    def __init__(self, path=JOBS_DB, ttl=JOB_TTL, max_bytes=JOB_RESULT_BYTES) -> None:
+        self.path = path
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        with self.connect() as db:
+            db.execute("PRAGMA journal_mode=WAL")  # readers don't block the workers
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS jobs ("
+                "id TEXT PRIMARY KEY, request TEXT NOT NULL, status TEXT NOT NULL, "
+                "result TEXT, error TEXT, submitted REAL NOT NULL, started REAL, "
+                "finished REAL, worker INTEGER, final INTEGER)"
+            )
+            try:
+                db.execute("ALTER TABLE jobs ADD COLUMN final INTEGER")
+            except sqlite3.OperationalError:
+                pass  # created with the column
+            db.execute(
+                "CREATE INDEX IF NOT EXISTS jobs_queued ON jobs (status, submitted)"
+            )
+            db.execute(
+                "CREATE INDEX IF NOT EXISTS jobs_finished ON jobs (status, finished)"
+            )
+
+    @contextlib.contextmanager
+    def connect(self):
+        # autocommit connection, closed (and rolled back if mid-transaction) on exit
+        db = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        try:
+            yield db
+        finally:
+            db.close()
+
+    def submit(self, job_id, request_json):
+        # queue a request, returns its status. Failed and cut short jobs are requeued
+        with self.connect() as db:
+            db.execute("BEGIN IMMEDIATE")
+            row = db.execute(
+                "SELECT status, final FROM jobs WHERE id = ?", (job_id,)
+            ).fetchone()
+            if row is None:
+                db.execute(
+                    "INSERT INTO jobs (id, request, status, submitted) "
+                    "VALUES (?, ?, ?, ?)",
+                    (job_id, json.dumps(request_json), QUEUED, time.time()),
+                )
+                status = QUEUED
+            elif row[0] == FAILED or (row[0] == DONE and not row[1]):
+                db.execute(
+                    "UPDATE jobs SET status = ?, error = NULL, result = NULL, "
+                    "submitted = ?, started = NULL, finished = NULL, final = NULL "
+                    "WHERE id = ?",
+                    (QUEUED, time.time(), job_id),
+                )
+                status = QUEUED
+            else:
+                status = row[0]  # duplicate of a queued, running or finished job
+            db.execute("COMMIT")
+        return status
+
+    def claim(self):
+        # oldest queued job as (id, request), marked running, or None
+        with self.connect() as db:
+            db.execute("BEGIN IMMEDIATE")
+            row = db.execute(
+                "SELECT id, request FROM jobs WHERE status = ? "
+                "ORDER BY submitted LIMIT 1",
+                (QUEUED,),
+            ).fetchone()
+            if row is not None:
+                db.execute(
+                    "UPDATE jobs SET status = ?, started = ?, worker = ? WHERE id = ?",
+                    (RUNNING, time.time(), os.getpid(), row[0]),
+                )
+            db.execute("COMMIT")
+        if row is None:
+            return None
+        return row[0], json.loads(row[1])
+
+    def complete(self, job_id, result, final=True):
+        # final is False for a search cut short by its time budget
+        with self.connect() as db:
+            db.execute(
+                "UPDATE jobs SET status = ?, result = ?, finished = ?, final = ? "
+                "WHERE id = ?",
+                (DONE, result, time.time(), bool(final), job_id),
+            )
+        self.evict()
+
+    def fail(self, job_id, error):
+        with self.connect() as db:
+            db.execute(
+                "UPDATE jobs SET status = ?, error = ?, finished = ? WHERE id = ?",
+                (FAILED, error, time.time(), job_id),
+            )
+        self.evict()
+
+    def evict(self):
+        # drop finished jobs past the ttl, then the oldest while over max_bytes
+        with self.connect() as db:
+            db.execute("BEGIN IMMEDIATE")
+            db.execute(
+                "DELETE FROM jobs WHERE status IN (?, ?) AND finished < ?",
+                (DONE, FAILED, time.time() - self.ttl),
+            )
+            finished = db.execute(
+                "SELECT id, length(result) FROM jobs WHERE status = ? "
+                "ORDER BY finished DESC",
+                (DONE,),
+            ).fetchall()
+            total = 0
+            for newer, (job_id, size) in enumerate(finished):
+                total += size or 0
+                if newer and total > self.max_bytes:  # the newest result always stays
+                    db.execute("DELETE FROM jobs WHERE id = ?", (job_id,))
+            db.execute("COMMIT")
+
+    def requeue_running(self):
+        # jobs left running by a worker process that has died
+        with self.connect() as db:
+            running = db.execute(
+                "SELECT id, worker FROM jobs WHERE status = ?", (RUNNING,)
+            ).fetchall()
+            for job_id, pid in running:
+                try:
+                    os.kill(pid, 0)  # signal 0 only checks that the process exists
+                    continue
+                except ProcessLookupError:
+                    pass
+                except PermissionError:
+                    continue  # alive, owned by another user
+                db.execute(
+                    "UPDATE jobs SET status = ?, started = NULL, worker = NULL "
+                    "WHERE id = ? AND status = ?",
+                    (QUEUED, job_id, RUNNING),
+                )
+
+    def status(self, job_id):
+        # {"job_id", "status", "error", "submitted", "started", "finished"}, or None
+        with self.connect() as db:
+            row = db.execute(
+                "SELECT status, error, submitted, started, finished FROM jobs "
+                "WHERE id = ?",
+                (job_id,),
+            ).fetchone()
+        if row is None:
+            return None
+        return dict(
+            zip(
+                ("job_id", "status", "error", "submitted", "started", "finished"),
+                (job_id,) + row,
+            )
+        )
+
+    def result(self, job_id):
+        # payload of a finished job, or None
+        with self.connect() as db:
+            row = db.execute(
+                "SELECT result FROM jobs WHERE id = ? AND status = ?", (job_id, DONE)
+            ).fetchone()
+        return None if row is None else row[0]
+
+
+class JobWorkers:
+    # threads that claim queued jobs and run them with run(request) -> (payload, final),
+    # final False when the result must not be reused by a duplicate submission. Each
+    # thread runs one job at a time, so concurrency is the number of fits in flight
+
+    def __init__(self, queue, run, concurrency=1, poll_seconds=1.0) -> None:
+        self.queue = queue
+        self.run = run
+        self.concurrency = concurrency
+        self.poll_seconds = poll_seconds
+        self.wakeup = threading.Event()
+        self.threads = []
+
+    def start(self):
+        self.queue.requeue_running()
+        for _ in range(self.concurrency):
+            thread = threading.Thread(target=self.work, daemon=True)
+            thread.start()
+            self.threads.append(thread)
+
+    def notify(self):
+        # a job was submitted, don't wait for the next poll
+        self.wakeup.set()
+
+    def work(self):
+        while True:
+            job = self.queue.claim()
+            if job is None:
+                self.wakeup.wait(self.poll_seconds)
+                self.wakeup.clear()
+                continue
+            job_id, request_json = job
+            try:
+                result, final = self.run(request_json)
+            except Exception as e:
+                self.queue.fail(job_id, f"{type(e).__name__}: {e}")
+            else:
+                self.queue.complete(job_id, result, final)
@@ -0,0 +1,106 @@
+import hashlib
+import json
+import os
+import tempfile
+
+CACHE_VERSION = 3  # bump whenever a code change alters the fitted output
+
+CACHE_DIR = os.environ.get(
+    "DPW_CACHE_DIR", os.path.join(tempfile.gettempdir(), "dies_per_wafer_cache")
+)  # empty string disables the cache
+CACHE_MAX_BYTES = int(os.environ.get("DPW_CACHE_MAX_BYTES", 256 * 2**20))
+
+
+# inputs normalized to float, so 20 and 20.0 share an entry. Integer inputs (seed,
+# starts, searchdepth) are kept exact: a float can't tell seeds above 2**53 apart
+FLOAT_INPUTS = (
+    "width",
+    "height",
+    "xspacing",
+    "yspacing",
+    "input_wafer_diameter",
+    "edge_exclusion_width",
+    "time_budget",
+)
+
+
+def cache_key(inputs):
+    # content address of a fit: sha256 of the canonical JSON of every input that can
+    # change the result
+    canonical = {"version": CACHE_VERSION}
+    for name, value in inputs.items():
+        if name in FLOAT_INPUTS and value is not None:
+            canonical[name] = float(value)
+        else:
+            canonical[name] = value
+    blob = json.dumps(canonical, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(blob.encode()).hexdigest()
+
+
+class ResultCache:
+    # Persistent cache of format_json_obj payloads, one file per key in a local directory.
+    # Reading a file in binary mode serves a multi-MB payload in a fraction of a
+    # millisecond, where SQLite has to walk a chain of overflow pages. The file mtime is
+    # the recency, and the least recently used files are evicted once the stored payloads
+    # exceed max_bytes
+
+    def __init__(self, directory=CACHE_DIR, max_bytes=CACHE_MAX_BYTES) -> None:
+        self.directory = directory
+        self.max_bytes = max_bytes
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, key):
+        return os.path.join(self.directory, key + ".json")
+
+    def get(self, key):
+        # stored payload for key, or None on a miss
+        path = self.path(key)
+        try:
+            with open(path, "rb") as f:
+                payload = f.read()
+            os.utime(path)  # mark as recently used
+        except FileNotFoundError:
+            return None  # never stored, or evicted by another process meanwhile
+        return payload.decode()
+
+    def put(self, key, payload):
+        payload = payload.encode()
+        if len(payload) > self.max_bytes:
+            return  # would evict everything else and still not fit
+        # write to a temporary file first so concurrent readers never see a partial entry
+        fd, temporary = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            f.write(payload)
+        os.replace(temporary, self.path(key))
+        self.evict()
+
+    def evict(self):
+        # drop least recently used entries until the payloads fit in max_bytes
+        entries = []
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith(".json"):
+                stat = entry.stat()
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass  # already evicted by another process
+            total -= size
+
+    def clear(self):
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith(".json"):
+                os.remove(entry.path)
+
+
+def with_cache_metadata(payload, hit, key, lookup_seconds):
+    # splice a "cache" entry into a stored payload without re-parsing it, so a hit stays
+    # cheap even for wafers with tens of thousands of dies
+    metadata = json.dumps(
+        {"hit": hit, "key": key, "lookup_ms": round(lookup_seconds * 1000, 4)}
+    )
+    return '{"cache": ' + metadata + ", " + payload[1:]
@@ -0,0 +1,195 @@
+"""
+Parameter sweeps of the dies per wafer
+
+Evaluates the best layout on the product of ranges of any inputs and returns one
+row per point with the inputs, the die count, the fit type and the final diameter.
+Points are split into chunks of adjacent points, and the chunks run in worker
+processes. Each worker keeps its FitMemo and NeighborIndex across its chunks, so
+equivalent points are fitted once and annealing starts from the solution of the
+previous point. Points in the atlas are not fitted at all.
+    python -m opt.sweep --width 5:20:0.5 --height 5:20:0.5 --out sweep.csv
+"""
+
+import argparse
+import csv
+import itertools
+import math
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+from opt.atlas import ATLAS_DIR, Atlas, decimal_range
+from opt.dies_per_wafer_calculator import DiesPerWaferCalculator
+from opt.fit_memo import FitMemo
+from opt.warm_start import NeighborIndex
+
+BASE = {  # inputs of every point unless swept
+    "width": 10.0,
+    "height": 10.0,
+    "xspacing": 0.1,
+    "yspacing": 0.1,
+    "waferdiameter": 300.0,
+    "edgeexclusionwidth": 3.0,
+}
+SPACING = "spacing"  # sweeps xspacing and yspacing together
+PARAMETERS = tuple(BASE) + (SPACING,)
+OUTPUTS = ("count", "fittype", "final_diameter", "upper_bound")
+
+worker_state = {}  # FitMemo, NeighborIndex and Atlas of a worker process
+
+
+def parse_range(text):
+    # "first:last:step", or a comma separated list of values
+    if ":" in text:
+        first, last, step = (float(v) for v in text.split(":"))
+        return decimal_range(first, last, step)
+    return [float(v) for v in text.split(",")]
+
+
+def sweep_points(ranges, base=None):
+    # input dicts of the product of ranges {parameter: values}, the last parameter
+    # varying fastest so consecutive points are neighbors
+    unknown = set(ranges) - set(PARAMETERS)
+    if unknown:
+        raise ValueError(
+            "Unknown sweep parameters {}, expected some of {}".format(
+                sorted(unknown), PARAMETERS
+            )
+        )
+    points = []
+    for values in itertools.product(*ranges.values()):
+        point = dict(BASE, **(base or {}))
+        for name, value in zip(ranges, values):
+            if name == SPACING:
+                point["xspacing"] = point["yspacing"] = value
+            else:
+                point[name] = value
+        points.append(point)
+    return points
+
+
+def get_worker_state():
+    if not worker_state:
+        worker_state["memo"] = FitMemo()
+        worker_state["neighbors"] = NeighborIndex()
+        worker_state["atlas"] = None
+        if os.path.isdir(ATLAS_DIR):
+            try:
+                worker_state["atlas"] = Atlas(ATLAS_DIR)
+            except Exception:
+                pass  # sweep without the atlas
+    return worker_state
+
+
+def fit_chunk(args):
+    # fit a chunk of adjacent points in order, run in a worker process
+    points, options = args
+    state = get_worker_state()
+    rows = []
+    for point in points:
+        if (
+            math.hypot(point["width"], point["height"]) / 2
+            > point["waferdiameter"] / 2 - point["edgeexclusionwidth"]
+        ):
+            rows.append(
+                dict(point, count=0, fittype=None, final_diameter=None, upper_bound=0)
+            )
+            continue  # not a single die fits
+        dpw = DiesPerWaferCalculator(searchdepth=0, **point, **options)
+        if state["atlas"] is None or not state["atlas"].apply(dpw):
+            x0 = state["neighbors"].lookup(dpw) if dpw.solver != "exact" else None
+            if not state["memo"].fit(dpw, x0):
+                state["neighbors"].add(dpw)
+        header = dpw.json_header()
+        rows.append(
+            dict(
+                point,
+                count=header["num_dies"],
+                fittype=header["fit_type"],
+                final_diameter=header["final_wafer_diameter"],
+                upper_bound=header["upper_bound"],
+            )
+        )
+    return rows
+
+
+def sweep(
+    ranges,
+    base=None,
+    ft_grid=True,
+    ft_ShiftRows=True,
+    ft_ShiftCols=True,
+    ft_ShiftRot=True,
+    symmetric=False,
+    solver="exact",
+    workers=None,
+    chunksize=16,
+):
+    # rows of the sweep over ranges {parameter: values}, in the order of sweep_points
+    points = sweep_points(ranges, base)
+    options = {
+        "ft_grid": ft_grid,
+        "ft_ShiftRows": ft_ShiftRows,
+        "ft_ShiftCols": ft_ShiftCols,
+        "ft_ShiftRot": ft_ShiftRot,
+        "symmetric": symmetric,
+        "solver": solver,
+    }
+    chunks = [
+        (points[i : i + chunksize], options) for i in range(0, len(points), chunksize)
+    ]
+    if workers == 1:  # in this process, e.g. for profiling
+        return [row for chunk_rows in map(fit_chunk, chunks) for row in chunk_rows]
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        return [row for chunk_rows in pool.map(fit_chunk, chunks) for row in chunk_rows]
+
+
+def write_csv(rows, f):
+    writer = csv.DictWriter(f, fieldnames=list(BASE) + list(OUTPUTS))
+    writer.writeheader()
+    writer.writerows(rows)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Sweep the dies per wafer")
+    for name in PARAMETERS:
+        parser.add_argument(
+            "--" + name,
+            type=parse_range,
+            help="first:last:step or a,b,c"
+            + ("" if name == SPACING else " (default {:g})".format(BASE[name])),
+        )
+    parser.add_argument(
+        "--fittypes", type=int, default=0b1111, help="bit ft enables fit type ft"
+    )
+    parser.add_argument("--symmetric", action="store_true")
+    parser.add_argument("--solver", default="exact")
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--chunksize", type=int, default=16)
+    parser.add_argument("--out", default=None, help="CSV file, stdout by default")
+    args = parser.parse_args()
+    ranges = {
+        name: getattr(args, name)
+        for name in PARAMETERS
+        if getattr(args, name) is not None
+    }
+    rows = sweep(
+        ranges,
+        ft_grid=bool(args.fittypes & 1),
+        ft_ShiftRows=bool(args.fittypes & 2),
+        ft_ShiftCols=bool(args.fittypes & 4),
+        ft_ShiftRot=bool(args.fittypes & 8),
+        symmetric=args.symmetric,
+        solver=args.solver,
+        workers=args.workers,
+        chunksize=args.chunksize,
+    )
+    if args.out is None:
+        write_csv(rows, sys.stdout)
+    else:
+        with open(args.out, "w", newline="") as f:
+            write_csv(rows, f)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,246 @@
+"""
+Compact response encodings of the wafer map
+
+"corners"   the default: four [x, y] corner pairs for every valid and partial die
+"runs"      runs of equally spaced dies along one grid axis ("along" x or y), as rows
+            of RUN_FIELDS. Die k of a run sits at (start + (m + k)*pitch) - shift
+            along the axis and at across on the other one, has the given width and
+            height, and is at flat index index + k*stride of the layout grid
+"columnar"  little-endian float64 columns x, y, width, height per die list, base64
+            encoded and optionally gzip compressed
+
+Both compact forms decode to exactly the lists of the corners encoding, in the same
+order. Only the run and column values are stored; the opposite corner is rebuilt as
+x + width and y + height, which is how the layout computes it.
+"""
+
+import base64
+import gzip
+import json
+
+import numpy as np
+
+ENCODINGS = ("corners", "runs", "columnar")
+MEDIA_TYPES = {
+    "application/x-dpw-runs+json": "runs",
+    "application/x-dpw-columnar+json": "columnar",
+}
+RUN_FIELDS = (
+    "index",
+    "start",
+    "m",
+    "pitch",
+    "shift",
+    "across",
+    "width",
+    "height",
+    "count",
+    "status",
+)
+COLUMNS = ("x", "y", "width", "height")
+VALID, PARTIAL = 1, 2  # run status
+
+
+def negotiate(accept):
+    # encoding requested through an Accept header, or None
+    for media_type in (accept or "").split(","):
+        encoding = MEDIA_TYPES.get(media_type.split(";")[0].strip())
+        if encoding is not None:
+            return encoding
+    return None
+
+
+def format_response(dpw, encoding="corners", compress=False, diagnostics=False):
+    # diagnostics=True appends dpw.diagnostics, serialization time included
+    if encoding not in ENCODINGS:
+        raise ValueError(
+            "Unknown encoding {!r}, expected one of {}".format(encoding, ENCODINGS)
+        )
+    with dpw.span("serialization"):
+        if encoding == "corners":
+            payload = dpw.format_json_obj()
+        elif encoding == "runs":
+            payload = encode_runs(dpw)
+        else:
+            payload = encode_columnar(dpw, compress)
+    if diagnostics:
+        payload = payload[:-1] + ', "diagnostics": ' + json.dumps(dpw.diagnostics) + "}"
+    return payload
+
+
+def die_status(dpw):
+    return np.where(dpw.valid, VALID, np.where(dpw.partial, PARTIAL, 0))
+
+
+def encode_runs(dpw):
+    status = die_status(dpw)
+    flat = np.arange(status.size).reshape(status.shape)
+    # runs go along whichever grid axis splits the dies into fewer segments: rows of the
+    # layout grid for Shift Rows and Shift & Rotate Rows, columns for Shift Columns
+    if segment_count(status, dpw.Ycorner, dpw, 0) <= segment_count(
+        status, dpw.Xcorner, dpw, 1
+    ):
+        along, stride = "x", status.shape[1]
+        arrays = (status, dpw.Xcorner, dpw.Ycorner, dpw.Xextent, dpw.Yextent, flat)
+        lines = [a.T for a in arrays + (dpw.Xextent,)]
+        spacing = dpw.xspacing
+    else:
+        along, stride = "y", 1
+        arrays = (status, dpw.Ycorner, dpw.Xcorner, dpw.Xextent, dpw.Yextent, flat)
+        lines = list(arrays + (dpw.Yextent,))
+        spacing = dpw.yspacing
+    runs = []
+    for line in zip(*lines):
+        runs.extend(line_runs(*line, spacing))
+    json_data = dpw.json_header()
+    json_data["encoding"] = "runs"
+    json_data["along"] = along
+    json_data["stride"] = stride
+    json_data["fields"] = list(RUN_FIELDS)
+    json_data["runs"] = runs
+    return json.dumps(json_data)
+
+
+def segment_count(status, across, dpw, axis):
+    # dies that can't continue the run of their predecessor along the grid axis
+    present = status > 0
+    starts = present.copy()
+    same = np.ones_like(present[:-1] if axis == 0 else present[:, :-1])
+    for a in (status, across, dpw.Xextent, dpw.Yextent):
+        same &= np.diff(a, axis=axis) == 0
+    if axis == 0:
+        starts[1:] &= ~(same & present[:-1])
+    else:
+        starts[:, 1:] &= ~(same & present[:, :-1])
+    return int(starts.sum())
+
+
+def line_runs(S, A, B, W, H, index, extent, spacing):
+    # split the dies of one grid line into runs. A is the coordinate along the line and
+    # B the one across it. The layout places die m of a line at (start + m*pitch) - shift
+    # with pitch = extent + spacing and shift = extent/2 (or 0 for Shift & Rotate), so
+    # that form reproduces A exactly where plain x0 + k*dx accumulates rounding errors
+    (present,) = np.nonzero(S)
+    if present.size == 0:
+        return []
+    # a run needs adjacent grid positions with the same status, extents and across value
+    breaks = np.nonzero(
+        (np.diff(present) != 1)
+        | (np.diff(S[present]) != 0)
+        | (np.diff(W[present]) != 0)
+        | (np.diff(H[present]) != 0)
+        | (np.diff(B[present]) != 0)
+    )[0]
+    M = np.arange(S.size) - (S.size - 1) // 2  # grid index, as Xoff/Yoff
+    runs = []
+    for segment in np.split(present, breaks + 1):
+        first = 0
+        while first < segment.size:
+            p = segment[first:]
+            # fallback run of one die that any rounding reproduces
+            count, start, m, pitch, shift = 1, float(A[p[0]]), 0, 0.0, 0.0
+            for candidate_shift in (extent[p[0]] / 2, 0.0):
+                candidate_pitch = extent[p[0]] + spacing
+                candidate_start = (A[p[0]] + candidate_shift) - M[
+                    p[0]
+                ] * candidate_pitch
+                exact = (
+                    (candidate_start + M[p] * candidate_pitch) - candidate_shift
+                ) == A[p]
+                candidate_count = p.size if exact.all() else int(np.argmin(exact))
+                if candidate_count > count:
+                    count = candidate_count
+                    start = float(candidate_start)
+                    m = int(M[p[0]])
+                    pitch = float(candidate_pitch)
+                    shift = float(candidate_shift)
+            runs.append(
+                [
+                    int(index[p[0]]),
+                    start,
+                    m,
+                    pitch,
+                    shift,
+                    float(B[p[0]]),
+                    float(W[p[0]]),
+                    float(H[p[0]]),
+                    count,
+                    int(S[p[0]]),
+                ]
+            )
+            first += count
+    return runs
+
+
+def decode_runs(json_data):
+    # valid_dies and partial_dies lists of the corners encoding
+    runs = json_data["runs"]
+    if not runs:
+        return [], []
+    columns = dict(zip(json_data["fields"], np.array(runs, dtype=float).T))
+    count = columns["count"].astype(int)
+    run = np.repeat(np.arange(len(runs)), count)
+    k = np.arange(count.sum()) - np.repeat(np.cumsum(count) - count, count)
+    index = columns["index"].astype(int)[run] + k * json_data["stride"]
+    order = np.argsort(index, kind="stable")
+    run, k = run[order], k[order]
+    along = (
+        columns["start"][run] + (columns["m"][run] + k) * columns["pitch"][run]
+    ) - columns["shift"][run]
+    across = columns["across"][run]
+    x, y = (along, across) if json_data["along"] == "x" else (across, along)
+    status = columns["status"][run]
+    return tuple(
+        corner_lists(
+            x[status == s],
+            y[status == s],
+            columns["width"][run][status == s],
+            columns["height"][run][status == s],
+        )
+        for s in (VALID, PARTIAL)
+    )
+
+
+def encode_columnar(dpw, compress=False):
+    json_data = dpw.json_header()
+    json_data["encoding"] = "columnar"
+    json_data["columns"] = list(COLUMNS)
+    json_data["dtype"] = "<f8"
+    json_data["compression"] = "gzip" if compress else None
+    for name, mask in (("valid_dies", dpw.valid), ("partial_dies", dpw.partial)):
+        data = np.stack(
+            (
+                dpw.Xcorner[mask],
+                dpw.Ycorner[mask],
+                dpw.Xextent[mask],
+                dpw.Yextent[mask],
+            )
+        ).astype("<f8")
+        blob = data.tobytes()
+        if compress:
+            blob = gzip.compress(blob, mtime=0)  # fixed mtime keeps payloads cacheable
+        json_data[name] = {
+            "count": int(data.shape[1]),
+            "data": base64.b64encode(blob).decode("ascii"),
+        }
+    return json.dumps(json_data)
+
+
+def decode_columnar(json_data):
+    # valid_dies and partial_dies lists of the corners encoding
+    lists = []
+    for name in ("valid_dies", "partial_dies"):
+        blob = base64.b64decode(json_data[name]["data"])
+        if json_data["compression"] == "gzip":
+            blob = gzip.decompress(blob)
+        data = np.frombuffer(blob, dtype=json_data["dtype"])
+        lists.append(
+            corner_lists(*data.reshape(len(COLUMNS), json_data[name]["count"]))
+        )
+    return tuple(lists)
+
+
+def corner_lists(x, y, width, height):
+    x1 = x + width
+    y1 = y + height
+    return np.stack((x, y, x1, y, x1, y1, x, y1), axis=1).reshape(-1, 4, 2).tolist()
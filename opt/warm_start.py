@@ -0,0 +1,127 @@
+"""
+Warm starts for the annealing from recently fitted, similar geometries
+
+NeighborIndex keeps the best offsets of every fit type of recent fits, keyed on the
+geometry normalized by the wafer radius. A new problem with the same fit types
+starts its annealing from the nearest stored solution when that one is within
+tolerance die pitches on every length. Stored offsets are fractions of their search
+bounds, and flag blocks are re-centered on the middle line, so a solution carries
+over to a geometry with a different number of lines.
+"""
+
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+UNSHIFTED = 0.25  # flag of a line that gets no half-pitch shift
+
+
+def geometry(dpw):
+    # lengths of the problem divided by the wafer radius
+    return np.array(
+        (
+            dpw.width,
+            dpw.height,
+            dpw.xspacing,
+            dpw.yspacing,
+            dpw.edgeexclusionwidth,
+        )
+    ) / (dpw.waferdiameter / 2)
+
+
+def group(dpw):
+    # only problems with the same offset layout can share warm starts
+    return (
+        bool(dpw.ft_grid),
+        bool(dpw.ft_ShiftRows),
+        bool(dpw.ft_ShiftCols),
+        bool(dpw.ft_ShiftRot),
+        bool(dpw.symmetric),
+    )
+
+
+def resize_flags(flags, size, centered):
+    # flags of size lines: the middle lines of a centered block (-N..N), the first lines
+    # of a symmetric one (0..N), new lines unshifted
+    out = np.full(size, UNSHIFTED)
+    n = min(size, flags.size)
+    if centered:
+        first, target = (flags.size - n) // 2, (size - n) // 2
+        out[target : target + n] = flags[first : first + n]
+    else:
+        out[:n] = flags[:n]
+    return out
+
+
+def transfer(fractions, dpw, ft):
+    # offsets of fit type ft on dpw from stored fractions of the search bounds
+    upper = np.array(dpw.annealbounds(ft))[:, 1]
+    if ft == 0:
+        return fractions * upper
+    blocks = np.split(fractions[1:], 2 if ft == 3 else 1)  # Shift & Rotate: 2 blocks
+    size = (len(upper) - 1) // len(blocks)
+    return (
+        np.concatenate(
+            [fractions[:1]] + [resize_flags(b, size, not dpw.symmetric) for b in blocks]
+        )
+        * upper
+    )
+
+
+class NeighborIndex:
+    # LRU of recent solutions, searched linearly: it is small and a lookup costs far
+    # less than a single annealing iteration
+
+    def __init__(self, maxsize=256, tolerance=0.1) -> None:
+        self.maxsize = maxsize
+        self.tolerance = tolerance  # in die pitches
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def add(self, dpw):
+        # store the offsets of a finished fit of dpw
+        offsets = getattr(dpw, "fitoffsets", None)
+        if offsets is None:
+            return  # restored from a memo or the atlas, nothing new
+        fractions = [
+            (
+                None
+                if x is None
+                else np.asarray(x, dtype=float) / np.array(dpw.annealbounds(ft))[:, 1]
+            )
+            for ft, x in enumerate(offsets)
+        ]
+        key = group(dpw) + tuple(geometry(dpw).tolist())
+        with self.lock:
+            self.entries[key] = (group(dpw), geometry(dpw), fractions)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+
+    def lookup(self, dpw):
+        # x0 for dpw.fit() from the nearest stored geometry, or None
+        features = geometry(dpw)
+        pitch = min(features[0] + features[2], features[1] + features[3])
+        with self.lock:
+            candidates = [
+                entry for entry in self.entries.values() if entry[0] == group(dpw)
+            ]
+        best, nearest = None, self.tolerance
+        for _, stored, fractions in candidates:
+            distance = np.abs(stored - features).max() / pitch
+            if distance <= nearest:
+                best, nearest = fractions, distance
+        with self.lock:
+            if best is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        if best is None:
+            return None
+        return [
+            None if fractions is None else transfer(fractions, dpw, ft)
+            for ft, fractions in enumerate(best)
+        ]